@@ -3,43 +3,84 @@
 from __future__ import print_function
 import argparse
 from time import time, sleep
-from datetime import datetime as dt
 from io import open
-import errno
+import hashlib
 import os
 import os.path
 import posixpath
+import shlex
+import shutil
 import sys
 import json
 import platform
-import subprocess
-import yaml
-from yaml import YAMLError
-import jinja2
-import requests
-from requests.exceptions import RequestException
-from pkg_resources import resource_string, parse_version, require
-import docker
-from docker.types import Mount
+import threading
 from alidock.argumentparser import AliDockArgumentParser
-from alidock.log import Log
-from alidock.util import splitEsc, getUserId, getUserName, execReturn, deactivateVenv, \
-  getRocmVideoGid
-
-LOG = Log()
-INSTALLER_URL = "https://raw.githubusercontent.com/alidock/alidock/master/alidock-installer.sh"
-
-class AliDockError(Exception):
-    def __init__(self, msg):
-        super(AliDockError, self).__init__()
-        self.msg = msg
-    def __str__(self):
-        return self.msg
+from alidock.bake import Baker
+from alidock.endpoint import Endpoint
+from alidock.fleet import FLEET_WORKERS, startFleetMember, stopFleetMember, printFleetStatus, \
+  logFleetStatus, logFleetResults
+from alidock.freeze import Freezer, logFreezeResults
+from alidock.initscript import ensureSshKeys, initDarwin, getInitParams, renderInitSh
+from alidock.keep import isStopped, stopKept, restartKept
+from alidock.log import LOG
+from alidock.mounts import parseMounts, getContainerMounts
+from alidock.pool import WarmPool, getContainerRunDir, makeRunDir
+from alidock.status import getStatus
+from alidock.trace import TRACE, loadProfile, saveHostSpans
+from alidock.transport import getDockerExecCommand
+from alidock.updates import UpdateChecker, streamPull, setPulling, processClientUpdates, \
+  processImageUpdates, processPrefetch
+from alidock.util import AliDockError, getUserId, getUserName, execReturn, BackgroundCall, \
+  parallelMap, spawnDetached, installHelper, getVersion
+
+PULL_ATTEMPTS = 5  # image pull attempts, with exponential backoff in between
+DOCKER_CLIENT_LOCK = threading.Lock()  # Docker clients are created once, from any thread
+
+class ContainerState(object):
+    """Snapshot of a container, taken with a single Docker API request (inspect). Its properties are
+       served from memory; the image tags are fetched at most once, and only if needed."""
+
+    def __init__(self, container):
+        self.container = container
+        self.attrs = container.attrs
+        self.imageAttrs = None
+
+    @property
+    def containerId(self):
+        return self.attrs["Id"]
+
+    @property
+    def status(self):
+        return self.attrs.get("State", {}).get("Status")
+
+    @property
+    def labels(self):
+        return self.attrs.get("Config", {}).get("Labels") or {}
+
+    @property
+    def ports(self):
+        return self.attrs.get("NetworkSettings", {}).get("Ports") or {}
+
+    @property
+    def imageName(self):
+        # The image name used at creation is in the inspect payload already
+        imageName = self.attrs.get("Config", {}).get("Image")
+        if imageName and not imageName.startswith("sha256:"):
+            return imageName
+        if self.imageAttrs is None:
+            self.imageAttrs = self.container.image.attrs
+        try:
+            return self.imageAttrs["RepoTags"][0]
+        except IndexError:
+            return self.imageAttrs["Id"]
 
 class AliDock(object):
 
     def __init__(self, overrideConf=None):
-        self.cli = docker.from_env()
+        self.dockerClient = None
+        self.dockerApi = None
+        self.endpoint = Endpoint(self)
+        self.containerState = None
         self.dirInside = "/home/alidock"
         self.userName = getUserName()
         self.conf = self.getDefaultConf()
@@ -48,6 +89,26 @@ class AliDock(object):
         self.conf["dockName"] = "{dockName}-{userId}".format(dockName=self.conf["dockName"],
                                                              userId=getUserId())
 
+    @property
+    def cli(self):
+        """Docker client, created upon first use: the hot path of `enter` and `exec` does not need
+           to contact the Docker daemon at all."""
+        with DOCKER_CLIENT_LOCK:  # update checks might use it from a different thread
+            if self.dockerClient is None:
+                import docker
+                self.dockerClient = docker.from_env()
+        return self.dockerClient
+
+    @property
+    def api(self):
+        """Lightweight read-only Docker client: it does not load the Docker SDK when the daemon is
+           reachable through a Unix socket."""
+        if self.dockerApi is None:
+            from alidock.dockerapi import MiniDockerClient, SdkDockerClient, getDockerSocket
+            sockPath = getDockerSocket()
+            self.dockerApi = MiniDockerClient(sockPath) if sockPath else SdkDockerClient(self.cli)
+        return self.dockerApi
+
     @staticmethod
     def getDefaultConf():
         return {
@@ -62,18 +123,38 @@ class AliDock(object):
             "mount"             : [],
             "cvmfs"             : False,
             "web"               : False,
+            "startTimeout"      : 30,
+            "warmPool"          : 0,
+            "idleTimeout"       : 14400,
+            "backgroundPull"    : False,
+            "prefetchMaxLoad"   : 0.5,
+            "buildCache"        : False,
+            "buildCacheSize"    : "20G",
+            "homeMountProfile"  : "cached",
+            "transport"         : "ssh",
             "debug"             : False
         }
 
+    @TRACE.traced("parseConfig")
     def parseConfig(self):
         confFile = os.path.join(os.path.expanduser("~"), ".alidock-config.yaml")
         try:
-            confOverride = yaml.safe_load(open(confFile).read())
+            with open(confFile) as fil:
+                confData = fil.read()
+        except (OSError, IOError):
+            return  # no configuration file: do not even load the YAML parser
+        import yaml
+        try:
+            confOverride = yaml.safe_load(confData)
             for k in self.conf:
                 self.conf[k] = confOverride.get(k, self.conf[k])
-        except (OSError, IOError, YAMLError, AttributeError):
+        except (yaml.YAMLError, AttributeError):
             pass
 
+    def exportConf(self):
+        """Return the current configuration in the form accepted by the constructor."""
+        return dict(self.conf, dockName=self.conf["dockName"].rsplit("-", 1)[0])
+
     def overrideConfig(self, override):
         if not override:
             return
@@ -81,25 +162,50 @@ class AliDock(object):
             if not override.get(k) is None:
                 self.conf[k] = override[k]
 
+    @TRACE.traced("isRunning")
+    def getContainerState(self):
+        """Return the ContainerState of the alidock container, or None if it does not exist. Docker
+           is asked only once per invocation, unless invalidateContainerState is called."""
+        import docker
+        from requests.exceptions import ChunkedEncodingError
+        if self.containerState is None:
+            try:
+                self.containerState = ContainerState(
+                    self.cli.containers.get(self.conf["dockName"]))
+            except (docker.errors.NotFound, ChunkedEncodingError):
+                return None
+        return self.containerState
+
+    def invalidateContainerState(self, container=None):
+        """Forget the cached container state. If the corresponding container object is given, with
+           up-to-date attributes, use it as the new state."""
+        self.containerState = ContainerState(container) if container else None
+
     def isRunning(self):
+        from requests.exceptions import ChunkedEncodingError
         runStatus = {}
-        try:
-            runContainer = self.cli.containers.get(self.conf["dockName"])
+        state = self.getContainerState()
+        if state:
             try:
-                runStatus["image"] = runContainer.image.attrs["RepoTags"][0]
-            except IndexError:
-                runStatus["image"] = runContainer.image.attrs["Id"]
-        except (docker.errors.NotFound, requests.exceptions.ChunkedEncodingError):
-            pass
+                runStatus["image"] = state.imageName
+            except ChunkedEncodingError:
+                pass
         return runStatus
 
-    def getSshCommand(self):
+    def getRunDir(self):
+        """Host path of the directory shared with the container for the current alidock name."""
         dockName = self.conf["dockName"].rsplit("-", 1)[0]
-        outPath = os.path.expanduser(os.path.join(self.conf["dirOutside"], ".alidock-" + dockName))
+        return os.path.expanduser(os.path.join(self.conf["dirOutside"], ".alidock-" + dockName))
+
+    def getRunDirInside(self):
+        """Path of the run directory as seen from inside the container."""
+        return posixpath.join(self.dirInside, ".alidock-" + self.conf["dockName"].rsplit("-", 1)[0])
+
+    def getSshCommand(self):
+        outPath = self.getRunDir()
         try:
-            attrs = self.cli.containers.get(self.conf["dockName"]).attrs
-            sshPort = attrs["NetworkSettings"]["Ports"]["22/tcp"][0]["HostPort"]
-        except (docker.errors.NotFound, KeyError, requests.exceptions.ChunkedEncodingError) as exc:
+            endpoint = self.endpoint.get()
+        except AliDockError as exc:
             outLog = os.path.join(outPath, "log.txt")
             try:
                 with open(outLog, "a+"):
@@ -111,12 +217,6 @@ class AliDock(object):
                                "version is updated. Error: {msg}"
                                .format(outLog=outLog, msg=exc))
 
-        # Private key path detection. Older versions of alidock use different paths: do not break!
-        privKey = os.path.join(outPath, "ssh", "alidock.pem")
-        if not os.path.isfile(privKey):
-            privKey = os.path.join(os.path.expanduser(self.conf["dirOutside"]),
-                                   ".alidock-ssh", "alidock.pem")
-
         if platform.system() != "Windows":
             # Reuse the same SSH connection for efficiency (not supported by Windows OpenSSH)
             sshControl = ["-oControlPersist=yes", "-oControlMaster=auto",
@@ -132,147 +232,59 @@ class AliDock(object):
 
         logLevel = "-oLogLevel=" + ("DEBUG" if self.conf["debug"] else "QUIET")
 
-        return ["ssh", "localhost", "-p", str(sshPort), "-F/dev/null", "-l", self.userName,
-                "-oUserKnownHostsFile=/dev/null", logLevel, "-oStrictHostKeyChecking=no",
-                "-oIdentitiesOnly=yes", "-i", privKey] + sshControl + xForward
-
-    def waitSshUp(self):
-        for _ in range(0, 50):
-            try:
-                nul = open(os.devnull, "w")
-                subprocess.check_call(self.getSshCommand() + ["-T", "/bin/true"],
-                                      stdout=nul, stderr=nul)
-            except subprocess.CalledProcessError:
-                sleep(0.5)
-            else:
-                return True
-        return False
+        return ["ssh", "localhost", "-p", str(endpoint["sshPort"]), "-F/dev/null", "-l",
+                self.userName, "-oUserKnownHostsFile=/dev/null", logLevel,
+                "-oStrictHostKeyChecking=no", "-oIdentitiesOnly=yes", "-i", endpoint["privKey"]] + \
+               sshControl + xForward
 
     def shell(self, cmd=None):
-        try:
-            attrs = self.cli.containers.get(self.conf["dockName"]).attrs
-            xPort = attrs["NetworkSettings"]["Ports"]["14500/tcp"][0]["HostPort"]
-        except (docker.errors.NotFound, KeyError, requests.exceptions.ChunkedEncodingError):
-            xPort = None
-        if not xPort and platform.system() == "Windows" and "DISPLAY" not in os.environ:
-            # On Windows if no DISPLAY environment is set we assume a sensible default
-            os.environ["DISPLAY"] = "127.0.0.1:0.0"
-        if xPort:
-            LOG.warning("X11 web browser access: http://localhost:{port}".format(port=xPort))
-        execReturn("ssh", self.getSshCommand() + (cmd if cmd else []))
+        if self.conf["transport"] == "docker":
+            cmd = cmd or []
+            if cmd[:1] == ["-t"]:
+                cmd = cmd[1:]  # SSH option: a terminal is used if we have one
+            dockerCmd = getDockerExecCommand(self, cmd, sys.stdin.isatty())
+            saveHostSpans(self.getRunDir())
+            execReturn("docker", dockerCmd)
+            return
+        with TRACE.span("shell"):
+            try:
+                xPort = self.endpoint.get()["xPort"]
+            except AliDockError:
+                xPort = None
+            if not xPort and platform.system() == "Windows" and "DISPLAY" not in os.environ:
+                # On Windows if no DISPLAY environment is set we assume a sensible default
+                os.environ["DISPLAY"] = "127.0.0.1:0.0"
+            if xPort:
+                LOG.warning("X11 web browser access: http://localhost:{port}".format(port=xPort))
+            sshCmd = self.getSshCommand() + (cmd if cmd else [])
+        saveHostSpans(self.getRunDir())
+        execReturn("ssh", sshCmd)
 
     def rootShell(self):
+        saveHostSpans(self.getRunDir())
         execReturn("docker", ["docker", "exec", "-it", self.conf["dockName"], "/bin/bash"])
 
-    def getUserMounts(self):
-        dockMounts = []
-        for mount in self.conf["mount"]:
-            src, label, mode = splitEsc(mount, ":", 2)
-            src = os.path.expanduser(src).rstrip("/")
-            if not src:
-                src = "/"
-            if os.path.isfile(src):
-                raise AliDockError("mount {src} is a file: only dirs allowed".format(src=src))
-            if not label:
-                label = "root" if src == "/" else os.path.basename(src)
-            elif "/" in label or label in [".", ".."]:
-                raise AliDockError("mount label {label} is invalid: label cannot contain a slash"
-                                   "and cannot be equal to \"..\" or \".\"".format(label=label))
-            mnt = posixpath.join("/", "mnt", label)
-            if not mode:
-                mode = "rw"
-            if mode not in ["rw", "ro"]:
-                raise AliDockError("supported modes for mounts are \"rw\" and \"ro\", "
-                                   "not {mode}".format(mode=mode))
-            dockMounts.append(Mount(mnt, src, type="bind", read_only=(mode == "ro"),
-                                    consistency="cached"))
-        return dockMounts
-
-    def initDarwin(self):
-        # macOS only: exclude "sw" directory from indexing and backup
-        outDir = os.path.expanduser(self.conf["dirOutside"])
-        swDir = os.path.join(outDir, ".sw")
-        swNoidx = os.path.join(outDir, ".sw.noindex")
-        if os.path.isdir(swDir) and not os.path.islink(swDir) and not os.path.exists(swNoidx):
-            # An old installation uses .sw: rename to .sw.noindex
-            os.rename(swDir, swNoidx)
-        try:
-            # Create .sw.noindex (not indexed by Spotlight because of `.noindex`)
-            os.mkdir(swNoidx)
-        except OSError as exc:
-            if not os.path.isdir(swNoidx) or exc.errno != errno.EEXIST:
-                raise AliDockError("cannot create {dir}".format(dir=swNoidx))
-        try:
-            # Symlink .sw -> .sw.noindex
-            os.symlink(".sw.noindex", swDir)
-        except OSError as exc:
-            if not os.path.islink(swDir) or exc.errno != errno.EEXIST:
-                raise AliDockError("cannot symlink .sw -> .sw.noindex %s" % str(exc))
-        try:
-            # Exclude .sw.noindex from Time Machine backups (check with `xattr`)
-            nul = open(os.devnull, "w")
-            subprocess.check_call(["tmutil", "addexclusion", swNoidx], stdout=nul, stderr=nul)
-        except subprocess.CalledProcessError as exc:
-            raise AliDockError("cannot exclude {dir} from Time Machine backups, "
-                               "tmutil returned {ret}".format(dir=swNoidx, ret=exc.returncode))
-
-    def run(self):
-        # Create directory to be shared with the container
-        outDir = os.path.expanduser(self.conf["dirOutside"])
-        dockName = self.conf["dockName"].rsplit("-", 1)[0]
-        runDir = os.path.join(outDir, ".alidock-" + dockName)
-        try:
-            os.makedirs(runDir)
-        except OSError as exc:
-            if not os.path.isdir(runDir) or exc.errno != errno.EEXIST:
-                raise AliDockError("cannot create directory {dir} to share with container, "
-                                   "check permissions".format(dir=self.conf["dirOutside"]))
-
-        dockDevices = []
-        # {"groupname": gid} added inside the container (gid=None == I don't care)
-        addGroups = {"video": getRocmVideoGid()}
-        if self.conf["enableRocmDevices"] and addGroups["video"]:
-            dockDevices += ["/dev/kfd", "/dev/dri"]
-        elif self.conf["enableRocmDevices"]:
-            raise AliDockError("cannot enable ROCm: check your ROCm installation")
-        else:
-            del addGroups["video"]
-
-        initShPath = os.path.join(runDir, "init.sh")
-        initSh = jinja2.Template(
-            resource_string("alidock.helpers", "init.sh.j2").decode("utf-8"))
-        with open(initShPath, "w", newline="\n") as fil:
-            fil.write(initSh.render(sharedDir=self.dirInside,
-                                    runDir=posixpath.join(self.dirInside, ".alidock-" + dockName),
-                                    dockName=dockName,
-                                    userName=self.userName,
-                                    userId=getUserId(),
-                                    useWebX11=self.conf["web"],
-                                    addGroups=addGroups))
-
-        os.chmod(initShPath, 0o700)
+    @TRACE.traced("run")
+    def run(self, poolId=None):
+        """Start a new container. If poolId is given, the container is started as a member of the
+           warm pool instead: it has a different name and its own subdirectory of the run directory,
+           and the container object is returned."""
+        runDir, runDirInside = makeRunDir(self, poolId)
+        initParams = getInitParams(self, runDirInside)
+        renderInitSh(os.path.join(runDir, "init.sh"), **initParams)
+        addGroups = initParams["addGroups"]
+        dockDevices = ["/dev/kfd", "/dev/dri"] if "video" in addGroups else []
+        ensureSshKeys(self)
 
         if platform.system() == "Darwin":
-            self.initDarwin()
+            initDarwin(os.path.expanduser(self.conf["dirOutside"]))
 
+        dockMounts = getContainerMounts(self, initParams["cacheSize"])
         dockEnvironment = []
         dockRuntime = None
 
-        # Define which mounts to expose to the container. On non-Linux, we need a native volume too
-        dockMounts = [Mount(self.dirInside, outDir, type="bind", consistency="cached")]
-        if platform.system() != "Linux":
-            dockMounts.append(Mount("/persist", "persist-"+self.conf["dockName"], type="volume"))
-
-        if self.conf["cvmfs"]:
-            dockMounts.append(Mount(source="/cvmfs",
-                                    target="/cvmfs",
-                                    type="bind",
-                                    propagation="shared" if platform.system() == "Linux" else None))
-
-        dockMounts += self.getUserMounts()  # user-defined mounts
-
         if self.conf["useNvidiaRuntime"]:
-            if self.hasRuntime("nvidia"):
+            if "nvidia" in self.cli.info()["Runtimes"].keys():
                 dockRuntime = "nvidia"
                 dockEnvironment = ["NVIDIA_VISIBLE_DEVICES=all"]
             else:
@@ -283,164 +295,182 @@ class AliDock(object):
         if self.conf["web"]:
             fwdPorts["14500/tcp"] = ("127.0.0.1", None)
 
-        # Start container with that script
-        self.cli.containers.run(self.conf["imageName"],
-                                command=[self.dirInside + "/.alidock-" + dockName + "/init.sh"],
-                                detach=True,
-                                auto_remove=True,
-                                cap_add=["SYS_PTRACE"],
-                                environment=dockEnvironment,
-                                hostname=self.conf["dockName"],
-                                name=self.conf["dockName"],
-                                mounts=dockMounts,
-                                ports=fwdPorts,
-                                runtime=dockRuntime,
-                                devices=dockDevices,
-                                group_add=addGroups.keys(),
-                                shm_size="1G")
+        dockLabels = getRunLabels(self, poolId, runDirInside, initParams["syncMounts"])
+        if not poolId:
+            # The init script creates the "ready" file when sshd is about to start
+            self.endpoint.clear()
+            self.endpoint.expectReady = True
+        bakedImage = Baker(self).getBakedImage()
+        if bakedImage:
+            # Started from the image baked on top of the configured one, which restartKept() checks
+            dockLabels["alidock.baseImageId"] = bakedImage[1]
+
+        # Start container with that script, and save its endpoint for the next invocations
+        container = self.cli.containers.run(
+            bakedImage[0] if bakedImage else self.conf["imageName"],
+            command=[posixpath.join(runDirInside, "init.sh")],
+            detach=True,
+            auto_remove=False,  # kept by `alidock stop --keep`, removed by `alidock stop`
+            cap_add=["SYS_PTRACE"],
+            environment=dockEnvironment,
+            hostname=self.conf["dockName"],
+            name=self.conf["dockName"] + ("-pool-" + poolId if poolId else ""),
+            labels=dockLabels,
+            mounts=dockMounts,
+            ports=fwdPorts,
+            runtime=dockRuntime,
+            devices=dockDevices,
+            group_add=addGroups.keys(),
+            shm_size="1G")
+        container.reload()  # attributes returned by run() do not include the assigned ports
+        if poolId:
+            return container
+        self.invalidateContainerState(container)
+        try:
+            self.endpoint.save(container.attrs)
+        except KeyError:
+            pass  # will be retrieved later on
 
         return True
 
-    def stop(self):
+    def stop(self, keep=False):
+        """Stop and remove the container. With keep, the container is only stopped: the next start
+           restarts it if the configuration did not change, without bootstrapping a new one."""
+        import docker
+        from requests.exceptions import ChunkedEncodingError
+        self.endpoint.clear()
+        state = self.getContainerState()
+        self.invalidateContainerState()
+        if not state:
+            return
+        syncScript = state.labels.get("alidock.syncMounts")
+        if syncScript and state.status == "running":
+            LOG.info("Syncing volume mounts back to the host")
+            try:
+                state.container.exec_run([syncScript])
+            except docker.errors.APIError as exc:
+                LOG.error("Cannot sync volume mounts back: {msg}".format(msg=exc))
+        if keep:
+            stopKept(self, state)
+            return
         try:
-            self.cli.containers.get(self.conf["dockName"]).remove(force=True)
-        except (docker.errors.NotFound, requests.exceptions.ChunkedEncodingError):
-            pass  # final state is fine, container is gone
-
-    def pull(self):
+            state.container.remove(force=True)
+        except (docker.errors.NotFound, ChunkedEncodingError):
+            return  # final state is fine, container is gone
+        if state.labels.get("alidock.runDir"):
+            # Container was claimed from the warm pool: clean up its own run directory
+            shutil.rmtree(getContainerRunDir(self, state), ignore_errors=True)
+
+    def listInstances(self):
+        """List all the alidock containers of the current user with a single Docker API request,
+           whatever their name. Returns a list of dicts with the alidock name (as set with --name),
+           image and status of each container. Members of the warm pools are not reported."""
+        from alidock.dockerapi import DockerApiError
+        userId = str(getUserId())
+        instances = []
         try:
-            self.cli.images.pull(self.conf["imageName"])
-        except docker.errors.APIError as exc:
+            conts = self.api.listContainers({"label": ["alidock.name", "alidock.userId=" + userId]})
+        except DockerApiError as exc:
             raise AliDockError(str(exc))
-
-    def hasRuntime(self, runtime):
-        return runtime in self.cli.info()["Runtimes"].keys()
-
-    def hasUpdates(self, stateFileRelative, updatePeriod, nagOnUpdate, updateFunc):
-        """Generic function that checks for updates every updatePeriod seconds, saving the state
-           on stateFileRelative (relative to the container's home directory). It returns True in
-           case there is an update, False in case there is none. A custom function updateFunc is
-           ran to determine whether to update. Set nagOnUpdate to True if, upon an update, the
-           state file should not be updated in order to trigger another check at the next run (this
-           nags users until they update)."""
-
-        tsDir = os.path.expanduser(self.conf["dirOutside"])
-        tsFn = os.path.join(tsDir, stateFileRelative)
+        for cont in conts or []:
+            name = cont["Labels"]["alidock.name"]
+            if "/{name}-{userId}".format(name=name, userId=userId) not in cont["Names"]:
+                continue  # not claimed from the warm pool yet
+            instances.append({"name": name, "image": cont.get("Image"),
+                              "status": cont.get("State")})
+        return sorted(instances, key=lambda inst: inst["name"])
+
+    def getLocalImageId(self):
+        """ID of the local image with the configured name, or None if it is not available."""
+        import docker
         try:
-            with open(tsFn) as fil:
-                lastUpdate = int(fil.read())
-        except (IOError, OSError, ValueError):
-            lastUpdate = 0
-
-        now = int(time())
-        updateAvail = False
-        if now - lastUpdate > int(updatePeriod):
-
-            caught = None
-            try:
-                updateAvail = updateFunc()
-            except AliDockError as exc:
-                caught = exc
-
-            if not updateAvail or not nagOnUpdate:
-                try:
-                    os.makedirs(tsDir)
-                except OSError as exc:
-                    if not os.path.isdir(tsDir) or exc.errno != errno.EEXIST:
-                        raise exc
-                with open(tsFn, "w") as fil:
-                    try:
-                        fil.write(str(now))
-                    except TypeError:
-                        fil.write(str(now).decode("utf-8"))
-
-            if caught is not None:
-                # pylint: disable=raising-bad-type
-                raise caught
-
-        return updateAvail
-
-    @staticmethod
-    def doAutoUpdate():
-        """Perform an automatic update of alidock only if it was installed in the custom virtual
-           environment."""
-        curModulePath = os.path.realpath(__file__)
-        virtualenvPath = os.path.realpath(os.path.expanduser("~/.virtualenvs/alidock"))
-        if curModulePath.startswith(virtualenvPath):
-            LOG.warning("Updating alidock automatically")
-            updateEnv = os.environ
-            deactivateVenv(updateEnv)
-            updateEnv["ALIDOCK_ARGS"] = " ".join(sys.argv[1:])
-            updateEnv["ALIDOCK_RUN"] = "1"
-            os.execvpe("bash",
-                       ["bash", "-c",
-                        "bash <(curl -fsSL {u}) --no-check-docker --quiet".format(u=INSTALLER_URL)],
-                       updateEnv)
-
-    def hasClientUpdates(self):
-        """Check for client updates (alidock) without performing them. Returns True if updates are
-           found, false otherwise."""
-
-        if str(require(__package__)[0].version) == "LAST-TAG":
-            # No check for local development or version from VCS
-            return False
-
-        def updateFunc():
-            try:
-                pyr = requests.get("https://pypi.org/pypi/{pkg}/json".format(pkg=__package__),
-                                   timeout=5)
-                pyr.raise_for_status()
-                pypiData = pyr.json()
-                availVersion = parse_version(pypiData["info"]["version"])
-                localVersion = parse_version(require(__package__)[0].version)
-                uploadTimeUTC = pypiData["releases"][str(availVersion)][0]["upload_time"]
-                uploadTimeUTC = dt.strptime(uploadTimeUTC, "%Y-%m-%dT%H:%M:%S")
-                updateAge = (dt.utcnow() - uploadTimeUTC).total_seconds()
-                if availVersion > localVersion and updateAge > 900:
-                    # Update is at least 15 min old to allow all PyPI caches to sync
-                    return True
-            except (RequestException, ValueError) as exc:
-                raise AliDockError(str(exc))
-            return False
-
-        return self.hasUpdates(stateFileRelative=".alidock_pip_check",
-                               updatePeriod=self.conf["updatePeriod"],
-                               nagOnUpdate=True,
-                               updateFunc=updateFunc)
-
-    def hasImageUpdates(self):
-        """Check for image updates without performing them. Returns True if updates are found, False
-           otherwise."""
-
-        if self.conf["dontUpdateImage"]:
-            return False
-
-        def updateFunc():
+            return self.cli.images.get(self.conf["imageName"]).id
+        except docker.errors.NotFound:
+            return None
+
+    def getFingerprint(self, withImage=True):
+        """Fingerprint of the configuration a new container would be started with: the local image
+           ID (unless withImage is False) and all the options valid at start. Containers with the
+           same fingerprint are interchangeable."""
+        imageId = self.getLocalImageId() if withImage else None
+        fingerprint = {k: self.conf[k] for k in ["dockName", "imageName", "dirOutside", "mount",
+                                                 "useNvidiaRuntime", "enableRocmDevices", "cvmfs",
+                                                 "web", "buildCache", "buildCacheSize",
+                                                 "homeMountProfile"]}
+        fingerprint["imageId"] = imageId
+        fingerprint["userName"] = self.userName
+        return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @TRACE.traced("pull")
+    def pull(self, progress=True, imageName=None):
+        """Pull the image (or imageName, if given), reporting the progress of its layers if
+           requested. Failed pulls are retried with exponential backoff: layers completed by a
+           previous attempt are kept by Docker, and they are not downloaded again."""
+        import docker
+        from requests.exceptions import RequestException
+        imageName = imageName or self.conf["imageName"]
+        for attempt in range(PULL_ATTEMPTS):
             try:
+                streamPull(self, progress, imageName)
+                break
+            except (AliDockError, docker.errors.APIError, RequestException) as exc:
+                if attempt == PULL_ATTEMPTS - 1:
+                    raise AliDockError("cannot pull {image}: {msg}".format(image=imageName,
+                                                                           msg=exc))
+                wait = 2 ** (attempt + 1)
+                LOG.warning("Pull failed ({msg}), retrying in {wait} s".format(msg=exc, wait=wait))
+                sleep(wait)
+        if imageName == self.conf["imageName"]:
+            UpdateChecker(self).setState(".alidock_docker_check", int(time()))
+            if Baker(self).loadRecord():
+                # The user bakes their image: bake it again on top of the new one
+                LOG.info("Baking your image again on top of the update")
                 try:
-                    localHash = self.cli.images.get(
-                        self.conf["imageName"]).attrs["RepoDigests"][0].split("@")[1]
-                except docker.errors.NotFound:
-                    # Image does not exist locally: no updates are available (run will fetch it)
-                    return False
-                availHash = self.cli.images.get_registry_data(
-                    self.conf["imageName"]).attrs["Descriptor"]["digest"]
-                return availHash != localHash
-            except (IndexError, docker.errors.APIError) as exc:
-                raise AliDockError(str(exc))
-
-        return self.hasUpdates(stateFileRelative=".alidock_docker_check",
-                               updatePeriod=self.conf["updatePeriod"],
-                               nagOnUpdate=False,
-                               updateFunc=updateFunc)
-
-def entrypoint():
+                    Baker(self).bake()
+                except AliDockError as exc:
+                    LOG.warning("Cannot bake your image: {msg}".format(msg=exc))
+
+def getRunLabels(aliDock, poolId, runDirInside, syncMounts):
+    """Labels of a new container of aliDock. Containers are labelled with their alidock name, for
+       discovery, and with the fingerprint of their configuration, to tell whether a stopped one can
+       be restarted (its image is checked separately). Pool members are labelled with the full
+       fingerprint, for claiming, and with their run directory."""
+    dockLabels = {"alidock.name": aliDock.conf["dockName"].rsplit("-", 1)[0],
+                  "alidock.userId": str(getUserId()),
+                  "alidock.fingerprint": aliDock.getFingerprint(withImage=False)}
+    if poolId:
+        dockLabels.update({"alidock.pool": aliDock.getFingerprint(),
+                           "alidock.runDir": posixpath.join("pool", poolId)})
+    if any(mnt["period"] for mnt in syncMounts):
+        # Volumes are synced back to the host one last time when stopping
+        dockLabels["alidock.syncMounts"] = posixpath.join(runDirInside, "sync-mounts.sh")
+    return dockLabels
+
+def getArgumentParser():
+    """Return the parser of the alidock command line arguments."""
     argp = AliDockArgumentParser(atStartTitle="only valid if container is not running, "
                                               "not effective otherwise")
     argp.addArgument("--quiet", "-q", dest="quiet", default=False, action="store_true",
                      help="Do not print any message")
     argp.addArgument("--version", "-v", dest="version", default=False, action="store_true",
                      help="Print current alidock version on stdout")
+    argp.addArgument("--json", dest="json", default=False, action="store_true",
+                     help="Print machine-readable output (works with status and profile)")
+    argp.addArgument("--stats", dest="stats", default=False, action="store_true",
+                     help="Report resource usage too (works with status)")
+    argp.addArgument("--all", "-a", dest="all", default=False, action="store_true",
+                     help="Act on all your alidock containers (works with status, stop and "
+                          "freeze)")
+    argp.addArgument("--keep", dest="keep", default=False, action="store_true",
+                     help="Stop the container without removing it: the next start restarts it "
+                          "if the configuration and image did not change (works with stop)")
+
+    argp.addArgument("--batch", dest="batch", default=False, action="store_true",
+                     help="Run the commands read from stdin, one per line, through a single "
+                          "session, and print their results as JSON lines (works with exec)")
+    argp.addArgument("--batch-socket", dest="batchSocket", default=None,
+                     help="Like --batch, but read commands from the clients of the given Unix "
+                          "socket (works with exec)")
 
     # tmux: both normal and terminal integration ("control mode")
     tmuxArgs = argp.add_mutually_exclusive_group()
@@ -459,6 +489,19 @@ def entrypoint():
     argp.addArgument("--no-update-alidock", dest="dontUpdateAlidock", default=None, config=True,
                      action="store_true",
                      help="Do not update alidock automatically")
+    argp.addArgument("--start-timeout", dest="startTimeout", default=None, config=True,
+                     help="Seconds to wait for the container to be ready")
+    argp.addArgument("--background-pull", dest="backgroundPull", default=None, config=True,
+                     action="store_true",
+                     help="Download image updates in the background, and keep using the current "
+                          "image until the container is started again")
+    argp.addArgument("--prefetch-max-load", dest="prefetchMaxLoad", default=None, config=True,
+                     help="Do not prefetch images if the load average per CPU is higher than this "
+                          "(works with prefetch)")
+    argp.addArgument("--transport", dest="transport", default=None, config=True,
+                     choices=["ssh", "docker"],
+                     help="Run commands through SSH (default) or through the Docker exec API, "
+                          "which does not wait for the SSH server but does not support X11")
     argp.addArgument("--debug", dest="debug", default=None, config=True,
                      action="store_true",
                      help="Increase verbosity")
@@ -470,7 +513,14 @@ def entrypoint():
                           help="Override host path of persistent home")
     argp.addArgumentStart("--mount", dest="mount", default=None, nargs="+", config=True,
                           help="Host dirs to mount under /mnt inside alidock, in the format "
-                               "/external/path[:label[:[rw|ro]]]")
+                               "/external/path[:label[:[rw|ro][:profile]]], where profile is "
+                               "cached (default), delegated, consistent, volume[=SECONDS] (native "
+                               "volume refreshed from the host dir at start, then synced back "
+                               "periodically without deleting files or overwriting newer ones on "
+                               "the host) or tmpfs[=SIZE] (no host dir)")
+    argp.addArgumentStart("--home-mount-profile", dest="homeMountProfile", default=None,
+                          config=True, choices=["cached", "delegated", "consistent"],
+                          help="Consistency of the shared home directory mount (macOS only)")
     argp.addArgumentStart("--no-update-image", dest="dontUpdateImage", default=None, config=True,
                           action="store_true",
                           help="Do not update the Docker image")
@@ -486,30 +536,85 @@ def entrypoint():
     argp.addArgumentStart("--web", dest="web", default=None, config=True,
                           action="store_true",
                           help="Make X11 available from a web browser")
+    argp.addArgumentStart("--build-cache", dest="buildCache", default=None, config=True,
+                          action="store_true",
+                          help="Mount a build cache (ccache and aliBuild tarballs) shared by all "
+                               "your containers (manage it with `alidock cache`)")
+    argp.addArgumentStart("--build-cache-size", dest="buildCacheSize", default=None, config=True,
+                          help="Size limit of the build cache, e.g. 20G")
+    argp.addArgumentStart("--warm-pool", dest="warmPool", default=None, config=True,
+                          help="Number of paused containers kept ready for a fast start "
+                               "(prepare them with `alidock warm`)")
+    argp.addArgument("--idle-timeout", dest="idleTimeout", default=None, config=True,
+                     help="Seconds without user processes after which containers are paused "
+                          "(works with freeze)")
 
     argp.add_argument("action", default="enter", nargs="?",
-                      choices=["enter", "root", "exec", "start", "status", "stop"],
+                      choices=["enter", "root", "exec", "start", "status", "stop", "warm",
+                               "profile", "mirrors", "cache", "prefetch", "bench-mounts",
+                               "freeze", "restart", "bake"],
                       help="What to do")
 
     argp.add_argument("shellCmd", nargs=argparse.REMAINDER,
-                      help="Command to execute in the container (works with exec)")
+                      help="Command to execute in the container (works with exec), names of the "
+                           "containers to act on (works with start, status, stop and freeze), "
+                           "`update [--jobs N] [--only PATTERN]...` (works with mirrors), or "
+                           "`stats` or `prune` (works with cache)")
 
     argp.genConfigHelp(AliDock.getDefaultConf())
+    return argp
+
+def parseArgs(argp):
+    """Parse the command line with the given parser. The switches given after the action are
+       recognized too, as long as the action does not take arbitrary arguments."""
     args = argp.parse_args()
+    if args.action != "exec":
+        # Options following the action end up in shellCmd: only exec takes arbitrary arguments
+        for opt, dest in [("--all", "all"), ("-a", "all"), ("--json", "json"),
+                          ("--stats", "stats"), ("--keep", "keep")]:
+            if opt in args.shellCmd:
+                args.shellCmd.remove(opt)
+                setattr(args, dest, True)
+    elif args.shellCmd[:1] == ["--batch"]:
+        args.shellCmd.pop(0)
+        args.batch = True
+    elif args.shellCmd[:1] == ["--batch-socket"] and len(args.shellCmd) > 1:
+        args.batchSocket = args.shellCmd[1]
+        del args.shellCmd[:2]
+    return args
 
+def entrypoint():
+    argp = getArgumentParser()
+    args = parseArgs(argp)
     LOG.setQuiet(args.quiet)
 
+    if args.version:
+        # Fast path: no need to load the Docker client and its dependencies
+        ver = getVersion()
+        if ver == "LAST-TAG":
+            ver = "development version"
+        print("{prog} {version}".format(prog=__package__, version=ver))
+        return
+
     try:
         processActions(args, argp.argsAtStart)
     except AliDockError as exc:
         LOG.error("Cannot continue: {msg}".format(msg=exc))
         exit(10)
-    except docker.errors.APIError as exc:
-        LOG.error("Docker error: {msg}".format(msg=exc))
-        exit(11)
-    except RequestException as exc:
-        LOG.error("Cannot communicate to Docker, is it running? Full error: {msg}".format(msg=exc))
-        exit(12)
+    except Exception as exc:  # pylint: disable=broad-except
+        # Docker and requests are loaded lazily: if they raised an exception they are already loaded
+        if "docker" not in sys.modules:
+            raise
+        import docker
+        from requests.exceptions import RequestException
+        if isinstance(exc, docker.errors.APIError):
+            LOG.error("Docker error: {msg}".format(msg=exc))
+            exit(11)
+        if isinstance(exc, RequestException):
+            LOG.error("Cannot communicate to Docker, is it running? Full error: {msg}"
+                      .format(msg=exc))
+            exit(12)
+        raise
 
 def checkArgsAtStart(args, argsAtStart):
     ignoredArgs = []
@@ -526,26 +631,52 @@ def checkArgsAtStart(args, argsAtStart):
         LOG.warning("    alidock stop")
         LOG.warning("and try again. Check `alidock --help` for more information")
 
-def processEnterStart(aliDock, args, argsAtStart):
-    created = False
-    if not aliDock.isRunning():
-        created = True
-
-        try:
-            if aliDock.hasImageUpdates():
-                LOG.info("Updating container image, hold on")
-                aliDock.pull()
-                LOG.warning("Container updated, you may want to free some space with:")
-                LOG.warning("    docker system prune")
-        except AliDockError:
-            LOG.warning("Cannot update container image this time")
-
+def createContainer(aliDock, args, imageCheck):
+    """Create the container, claiming one from the warm pool if possible, after applying the image
+       updates found by the imageCheck BackgroundCall, if any."""
+    if imageCheck:
+        processImageUpdates(aliDock, imageCheck)
+    if int(aliDock.conf["warmPool"]) > 0 and WarmPool(aliDock).claim():
+        LOG.info("Using a container from the warm pool")
+    else:
         LOG.info("Creating container, hold on")
         aliDock.run()
-    else:
-        # Container is running. Check if user has specified parameters that will be ignored and warn
+    if int(aliDock.conf["warmPool"]) > 0:
+        spawnDetached("fillWarmPoolDetached", args.__dict__)
+
+def prepareContainer(aliDock, args, argsAtStart):
+    """Make sure the container is running, creating, restarting or resuming it as needed. Returns a
+       tuple telling whether it was known to be ready without contacting Docker, and whether it
+       was created or restarted."""
+    if args.action in ["enter", "exec", "start", "mirrors", "cache", "bench-mounts"] and \
+       aliDock.endpoint.isReady():
+        # Fast path: the running container can be used right away, no need to load the Docker SDK
         checkArgsAtStart(args, argsAtStart)
+        return True, False
 
+    # Check for image updates while we ask Docker about the container
+    imageCheck = BackgroundCall(UpdateChecker(aliDock).hasImageUpdates)
+    if not aliDock.isRunning():
+        createContainer(aliDock, args, imageCheck)
+        return False, True
+    if isStopped(aliDock):
+        # Kept by `alidock stop --keep`: restart it, unless the image or configuration changed
+        processImageUpdates(aliDock, imageCheck)
+        if restartKept(aliDock):
+            LOG.info("Restarting the stopped container")
+        else:
+            createContainer(aliDock, args, None)
+        return False, True
+
+    # Container exists. Check if user has specified parameters that will be ignored and warn
+    if Freezer(aliDock).unfreeze():
+        LOG.info("Resumed the container, which was frozen because idle")
+    checkArgsAtStart(args, argsAtStart)
+    return False, False
+
+def getActionCommand(aliDock, args):
+    """Return the arguments of the shell running the given action in the container, and tell the
+       user what is going to happen."""
     if args.action == "enter":
         if (args.tmux or args.tmuxControl) and os.environ.get("TMUX") is None:
             LOG.info("Resuming tmux session in the container")
@@ -557,63 +688,273 @@ def processEnterStart(aliDock, args, argsAtStart):
         else:
             LOG.info("Starting a shell into the container")
             cmd = []
-        aliDock.waitSshUp()
-        aliDock.shell(cmd)
-    elif args.action == "exec":
+        return cmd
+    if args.action == "exec":
         LOG.info("Executing command in the container")
-        aliDock.waitSshUp()
-        aliDock.shell(["-t"] + args.shellCmd)
+        return ["-t"] + args.shellCmd
+    if args.action in ["mirrors", "cache"]:
+        if args.action == "mirrors":
+            LOG.info("Updating aliBuild mirrors in the container")
+            cmd = ["aliBuildUpdateMirrors"] + args.shellCmd[1:]
+        else:
+            cmd = ["alidockCache"] + args.shellCmd
+        # Run in a login shell, where the functions are defined, whatever the transport
+        return ["-t", "bash", "-lc", shlex.quote(" ".join(shlex.quote(arg) for arg in cmd))]
+    assert args.action == "bench-mounts", "invalid action"
+    LOG.info("Benchmarking the mounts in the container, this can take a while")
+    dirs = [aliDock.dirInside, "/persist", "/cache", "/tmp"] + \
+           [mnt["target"] for mnt in parseMounts(aliDock.conf["mount"])]
+    return ["-t", "bash", installHelper(aliDock, "bench-mounts.sh")] + dirs
+
+def processEnterStart(aliDock, args, argsAtStart, clientCheck):
+    ready, started = prepareContainer(aliDock, args, argsAtStart)
+    if args.action == "exec" and (args.batch or args.batchSocket):
+        if args.shellCmd:
+            raise AliDockError("commands to execute in batch mode are not given as arguments")
+        LOG.info("Executing batches of commands in the container")
+        if not ready:
+            aliDock.endpoint.waitUp()
+        processClientUpdates(aliDock, clientCheck)
+        from alidock.batch import execBatch
+        execBatch(aliDock, os.path.expanduser(args.batchSocket) if args.batchSocket else None)
+    elif args.action in ["enter", "exec", "mirrors", "cache", "bench-mounts"]:
+        cmd = getActionCommand(aliDock, args)
+        if not ready:
+            aliDock.endpoint.waitUp()
+        processClientUpdates(aliDock, clientCheck)
+        aliDock.shell(cmd)
     elif args.action == "root":
         LOG.info("Starting a root shell into the container (use it at your own risk)")
+        processClientUpdates(aliDock, clientCheck)
         aliDock.rootShell()
-    elif not created:
-        LOG.info("Container is already running")
+    else:
+        processClientUpdates(aliDock, clientCheck)
+        saveHostSpans(aliDock.getRunDir())
+        if not started:
+            LOG.info("Container is already running")
+
+def fillWarmPoolDetached():
+    """Replenish the warm pool: entry point of the process spawned by spawnDetached."""
+    LOG.setQuiet()
+    try:
+        WarmPool(AliDock(json.loads(os.environ["ALIDOCK_DETACHED_ARGS"]))).fill()
+    except (AliDockError, KeyError, ValueError):
+        pass
 
-def processStatus(aliDock):
-    runStatus = aliDock.isRunning()
-    if runStatus:
+def pullDetached():
+    """Pull the image in the background: entry point of the process spawned by spawnDetached."""
+    LOG.setQuiet()
+    try:
+        aliDock = AliDock(json.loads(os.environ["ALIDOCK_DETACHED_ARGS"]))
+    except (KeyError, ValueError):
+        return
+    try:
+        setPulling(aliDock, True)
+        aliDock.pull(progress=False)
+    except AliDockError:
+        pass
+    finally:
+        setPulling(aliDock, False)
+
+def checkClientUpdatesDetached():
+    """Check for alidock updates, saving the result for the next run: entry point of the process
+       spawned by spawnDetached when the check of the current run does not complete in time."""
+    LOG.setQuiet()
+    try:
+        aliDock = AliDock(json.loads(os.environ["ALIDOCK_DETACHED_ARGS"]))
+        UpdateChecker(aliDock).hasClientUpdates(force=True)
+    except Exception:  # pylint: disable=broad-except
+        pass  # nobody to report to
+
+def checkImageUpdatesDetached():
+    """Check for image updates, saving the result for the next run: see
+       checkClientUpdatesDetached."""
+    LOG.setQuiet()
+    try:
+        aliDock = AliDock(json.loads(os.environ["ALIDOCK_DETACHED_ARGS"]))
+        UpdateChecker(aliDock).hasImageUpdates(force=True)
+    except Exception:  # pylint: disable=broad-except
+        pass
+
+def processWarm(aliDock):
+    if int(aliDock.conf["warmPool"]) <= 0:
+        LOG.info("Warm pool size is 0 (set it with --warm-pool): removing all warm containers")
+        WarmPool(aliDock).fill()
+        return
+    LOG.info("Preparing {num} warm container(s), hold on".format(num=aliDock.conf["warmPool"]))
+    added = WarmPool(aliDock).fill()
+    LOG.info("Warm pool ready ({added} container(s) added)".format(added=added))
+
+def processProfile(aliDock, asJson):
+    profile = loadProfile(aliDock.getRunDir())
+    if not profile:
+        raise AliDockError("no profiling information found: enter or start alidock first")
+    if asJson:
+        print(json.dumps(profile, indent=2))
+        return
+    fmt = "{name:<20} {source:<6} {offset:>12} {duration:>12}"
+    print(fmt.format(name="phase", source="where", offset="start (ms)", duration="duration (ms)"))
+    for span in profile["spans"]:
+        print(fmt.format(name=span["name"], source=span["source"],
+                         offset="{:.1f}".format(span["offsetMs"]),
+                         duration="{:.1f}".format(span["durationMs"])))
+
+def processStatus(aliDock, asJson, withStats):
+    status = getStatus(aliDock, withStats)
+    if asJson:
+        print(json.dumps(status, indent=2, sort_keys=True))
+    elif status["running"]:
         LOG.info("Container is running (name: {name}, image: {image})".format(
-            name=aliDock.conf["dockName"], image=runStatus["image"]))
-        exit(0)
-    LOG.error("Container is not running")
-    exit(1)
-
-def processStop(aliDock):
-    LOG.info("Shutting down the container")
-    aliDock.stop()
-
-def processActions(args, argsAtStart):
-
-    if args.version:
-        ver = str(require(__package__)[0].version)
-        if ver == "LAST-TAG":
-            ver = "development version"
-        print("{prog} {version}".format(prog=__package__, version=ver))
+            name=aliDock.conf["dockName"], image=status["image"]))
+    else:
+        LOG.error("Container is not running")
+    sys.exit(0 if status["running"] else 1)
+
+def processFreeze(aliDock, args):
+    """Freeze (pause) the containers of the current user which have been idle for longer than the
+       idle timeout: meant to be run periodically, e.g. from cron. Containers are resumed as soon as
+       they are needed. Reports the memory held by the frozen containers, and how much of it the
+       kernel has reclaimed since they were frozen."""
+    if args.all and args.shellCmd:
+        raise AliDockError("specify either --all or a list of names, not both")
+    names = args.shellCmd or [inst["name"] for inst in aliDock.listInstances()]
+    if not names:
+        LOG.info("No alidock container found")
         return
-
+    results = parallelMap(
+        lambda member: Freezer(member).freezeIfIdle(member.conf["idleTimeout"]),
+        getFleet(args, names, aliDock.cli), FLEET_WORKERS)
+    failed = logFreezeResults(names, results)
+    if failed:
+        raise AliDockError("{failed} out of {num} containers could not be checked".format(
+            failed=failed, num=len(names)))
+
+def processBake(aliDock):
+    """Bake the user's image, which new containers start from. The configured image is pulled first
+       if it is not available."""
+    if not aliDock.getLocalImageId():
+        LOG.info("Pulling {image} first".format(image=aliDock.conf["imageName"]))
+        aliDock.pull()
+    LOG.info("Baking your image on top of {image}, hold on".format(
+        image=aliDock.conf["imageName"]))
+    imageName, baked = Baker(aliDock).bake()
+    if baked:
+        LOG.info("Baked {image}: new containers start from it".format(image=imageName))
+    else:
+        LOG.info("Your baked image {image} is up to date".format(image=imageName))
+
+def processStop(aliDock, keep):
+    LOG.info("Stopping the container (it is kept for a fast restart)" if keep else
+             "Shutting down the container")
+    aliDock.stop(keep)
+
+def getFleet(args, names, dockerClient=None):
+    """Return an AliDock object for each one of the given alidock names, configured with the given
+       arguments and sharing the given Docker client (if any)."""
+    fleet = []
+    for name in names:
+        member = AliDock(dict(args.__dict__, dockName=name))
+        member.dockerClient = dockerClient
+        fleet.append(member)
+    return fleet
+
+def processFleet(aliDock, args):
+    """Start, stop or report the status of several alidock containers at once. Containers are
+       either given by name, or all the containers of the current user are discovered by label.
+       Operations are performed concurrently, and their timings reported."""
+    if args.all and args.shellCmd:
+        raise AliDockError("specify either --all or a list of names, not both")
+    if args.all and args.action == "start":
+        raise AliDockError("--all does not work with start: specify the names to start")
+
+    if args.action == "status" and args.json:
+        names = args.shellCmd or [inst["name"] for inst in aliDock.listInstances()]
+        sys.exit(0 if printFleetStatus(names, getFleet(args, names), args.stats) else 1)
+    if args.action == "status":
+        # A single Docker API request is enough to report the status of all labelled containers
+        sys.exit(0 if logFleetStatus(args.shellCmd, aliDock.listInstances(),
+                                     lambda name: getFleet(args, [name])[0]) else 1)
+
+    names = args.shellCmd or [inst["name"] for inst in aliDock.listInstances()]
+    if not names:
+        LOG.info("No alidock container found")
+        return
+    members = getFleet(args, names, aliDock.cli)
+    if args.action == "start":
+        # All containers use the same image: check it only once
+        processImageUpdates(aliDock, BackgroundCall(UpdateChecker(aliDock).hasImageUpdates))
+        LOG.info("Starting {num} container(s), hold on".format(num=len(members)))
+        results = parallelMap(startFleetMember, members, FLEET_WORKERS)
+    else:
+        LOG.info("Shutting down {num} container(s)".format(num=len(members)))
+        results = parallelMap(lambda member: stopFleetMember(member, args.keep), members,
+                              FLEET_WORKERS)
+    failed = logFleetResults(names, results)
+    if failed:
+        raise AliDockError("{failed} out of {num} operations failed".format(failed=failed,
+                                                                             num=len(members)))
+
+def getAliDock(args):
+    """Return the AliDock object configured with the command line arguments args (and with the
+       configuration file), after checking that it can be used."""
     if getUserId() == 0:
         raise AliDockError("refusing to execute as root: use an unprivileged user account")
 
     aliDock = AliDock(args.__dict__)
+    if aliDock.conf["debug"]:
+        TRACE.setLog(LOG)
+    if aliDock.conf["transport"] not in ["ssh", "docker"]:
+        raise AliDockError("invalid transport {transport}: use ssh or docker"
+                           .format(transport=aliDock.conf["transport"]))
+    return aliDock
+
+def checkActionArgs(args):
+    """Check that the arguments given on the command line can be used with the requested action.
+       Raises AliDockError with the correct usage otherwise."""
+    if args.all and args.action not in ["start", "status", "stop", "freeze"]:
+        raise AliDockError("--all only works with status, stop and freeze")
+    if args.action == "mirrors" and args.shellCmd[:1] != ["update"]:
+        raise AliDockError("usage: alidock mirrors update [--jobs N] [--only PATTERN]...")
+    if args.action == "cache" and args.shellCmd not in [["stats"], ["prune"]]:
+        raise AliDockError("usage: alidock cache stats|prune")
+    if args.action == "restart" and args.shellCmd:
+        raise AliDockError("restart acts on one container: use --name to select it")
 
-    try:
-        hasUpdates = aliDock.hasClientUpdates()
-        if hasUpdates and platform.system() == "Windows":
-            # No auto update on Windows at the moment
-            LOG.error("You are using an obsolete version of alidock. Use pip to upgrade it.")
-        elif hasUpdates and not aliDock.conf["dontUpdateAlidock"]:
-            aliDock.doAutoUpdate()
-            LOG.error("You are using an obsolete version of alidock.")
-            LOG.error("Upgrade NOW with:")
-            LOG.error("    bash <(curl -fsSL {url})".format(url=INSTALLER_URL))
-    except AliDockError:
-        LOG.warning("Cannot check for alidock updates this time")
-
-    if args.action in ["enter", "exec", "root", "start"]:
-        processEnterStart(aliDock, args, argsAtStart)
+def processActions(args, argsAtStart):
+    aliDock = getAliDock(args)
+
+    # Check for alidock updates in the background: the result is applied when actually needed. No
+    # check is done for the machine-readable status, which is meant to be polled by scripts
+    clientCheck = None
+    if args.action not in ["prefetch", "freeze"] and (args.action != "status" or not args.json):
+        clientCheck = BackgroundCall(UpdateChecker(aliDock).hasClientUpdates)
+
+    checkActionArgs(args)
+    if args.action in ["start", "status", "stop"] and (args.all or args.shellCmd):
+        processClientUpdates(aliDock, clientCheck)
+        processFleet(aliDock, args)
+    elif args.action == "restart":
+        processStop(aliDock, keep=True)
+        processEnterStart(aliDock, args, argsAtStart, clientCheck)
+    elif args.action in ["enter", "exec", "root", "start", "mirrors", "cache", "bench-mounts"]:
+        processEnterStart(aliDock, args, argsAtStart, clientCheck)
     elif args.action == "status":
-        processStatus(aliDock)
+        processClientUpdates(aliDock, clientCheck)
+        processStatus(aliDock, args.json, args.stats)
     elif args.action == "stop":
-        processStop(aliDock)
+        processClientUpdates(aliDock, clientCheck)
+        processStop(aliDock, args.keep)
+    elif args.action == "warm":
+        processClientUpdates(aliDock, clientCheck)
+        processWarm(aliDock)
+    elif args.action == "profile":
+        processProfile(aliDock, args.json)
+    elif args.action == "prefetch":
+        processPrefetch(aliDock)
+    elif args.action == "freeze":
+        processFreeze(aliDock, args)
+    elif args.action == "bake":
+        processClientUpdates(aliDock, clientCheck)
+        processBake(aliDock)
     else:
         assert False, "invalid action"
@@ -1,7 +1,6 @@
 import os.path
 import argparse
 from collections import namedtuple
-import yaml
 
 AliDockArg = namedtuple("AliDockArg", "option config descr")
 
@@ -13,6 +12,7 @@ class AliDockArgumentParser(argparse.ArgumentParser):
     def __init__(self, atStartTitle):
         self.argsNormal = []
         self.argsAtStart = []
+        self.defaultConf = None
         super(AliDockArgumentParser, self).__init__(formatter_class=argparse.RawTextHelpFormatter)
         self.groupAtStart = self.add_argument_group(atStartTitle)
 
@@ -38,6 +38,16 @@ class AliDockArgumentParser(argparse.ArgumentParser):
         return self.addArgument(*args, **kwargs)
 
     def genConfigHelp(self, defaultConf):
+        # Help is generated lazily: loading the YAML module is not needed for normal operations
+        self.defaultConf = defaultConf
+
+    def format_help(self):
+        if self.defaultConf is not None:
+            self.epilog = self.genConfigEpilog(self.defaultConf)
+        return super(AliDockArgumentParser, self).format_help()
+
+    def genConfigEpilog(self, defaultConf):
+        import yaml
         confFile = os.path.join(os.path.expanduser("~"), ".alidock-config.yaml")
         epilog = "it is possible to specify the most frequently used options in a YAML " \
                  "configuration file in {confFile}\n" \
@@ -55,4 +65,4 @@ class AliDockArgumentParser(argparse.ArgumentParser):
         for yLine in yamlLines:
             epilog += fmt % (yamlLines[yLine], yLine)
 
-        self.epilog = epilog
+        return epilog
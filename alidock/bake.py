@@ -0,0 +1,161 @@
+"""Baked images: see `alidock bake`. The steps of the init script setting up the user and the system
+are run once in a temporary container, which is committed as a local image new containers start
+from."""
+
+import errno
+import json
+import os
+import os.path
+import posixpath
+from time import time
+from alidock.initscript import getInitParams, renderInitSh
+from alidock.log import LOG
+from alidock.trace import TRACE
+from alidock.util import AliDockError, getUserId
+
+BAKED_REPOSITORY = "alidock-baked-{userId}"  # local repository of the images made by `alidock bake`
+
+class Baker(object):
+    """Bakes the image of the given AliDock object. The last baked image is recorded in its run
+       directory, with the base image and the configuration fingerprint it is valid for."""
+
+    def __init__(self, aliDock):
+        self.aliDock = aliDock
+        self.recordPath = os.path.join(aliDock.getRunDir(), "bake.json")
+
+    def loadRecord(self):
+        """Return the record of the image last baked by `alidock bake` for the current alidock name,
+           or None if the user does not bake their image."""
+        try:
+            with open(self.recordPath) as fil:
+                record = json.loads(fil.read())
+            return record if isinstance(record, dict) else None
+        except (IOError, OSError, ValueError):
+            return None
+
+    def saveRecord(self, record):
+        try:
+            with open(self.recordPath, "w") as fil:
+                fil.write(json.dumps(record))
+        except (IOError, OSError) as exc:
+            raise AliDockError("cannot save the bake record: {msg}".format(msg=exc))
+
+    def getBakedImage(self):
+        """Return the name of the baked image new containers should start from, and the ID of the
+           image it was baked on, or None if there is no baked image valid for the current image
+           and configuration. Costs no Docker request if the user does not bake their image."""
+        conf = self.aliDock.conf
+        record = self.loadRecord()
+        if not record or record.get("baseImage") != conf["imageName"] or \
+           record.get("fingerprint") != self.aliDock.getFingerprint(withImage=False):
+            return None
+        from alidock.dockerapi import DockerApiError
+        try:
+            base = self.aliDock.api.inspectImage(conf["imageName"])
+            baked = self.aliDock.api.inspectImage(record["image"]) if base else None
+        except (DockerApiError, KeyError) as exc:
+            raise AliDockError("cannot inspect the baked image: {msg}".format(msg=exc))
+        if not base or not baked or base["Id"] != record.get("baseImageId"):
+            LOG.warning("Your baked image is out of date, not using it: update it with "
+                        "`alidock bake`")
+            return None
+        return record["image"], base["Id"]
+
+    def prepareInitSh(self):
+        """Render the init script of the temporary container in the bake directory. Returns the path
+           of the directory on the host and in the container."""
+        bakeDir = os.path.join(self.aliDock.getRunDir(), "bake")
+        bakeDirInside = posixpath.join(self.aliDock.getRunDirInside(), "bake")
+        try:
+            os.makedirs(bakeDir)
+        except OSError as exc:
+            if not os.path.isdir(bakeDir) or exc.errno != errno.EEXIST:
+                raise AliDockError("cannot create directory {dir}: {msg}".format(dir=bakeDir,
+                                                                                msg=exc))
+        renderInitSh(os.path.join(bakeDir, "init.sh"), **getInitParams(self.aliDock, bakeDirInside))
+        return bakeDir, bakeDirInside
+
+    @staticmethod
+    def getChanges(base):
+        """Dockerfile instructions applied to the baked image: the configured command is restored,
+           the one of the temporary container is not meaningful."""
+        changes = ['LABEL alidock.baseImageId="{id}"'.format(id=base.id)]
+        if base.attrs.get("Config", {}).get("Cmd"):
+            changes.append("CMD " + json.dumps(base.attrs["Config"]["Cmd"]))
+        return changes
+
+    def commitInit(self, base, repository, tag):
+        """Run the init script in a temporary container started from the base image, and commit it
+           as repository:tag."""
+        import docker
+        from docker.types import Mount
+        from requests.exceptions import RequestException
+        cli = self.aliDock.cli
+        dockName = self.aliDock.conf["dockName"]
+        bakeDir, bakeDirInside = self.prepareInitSh()
+        container = None
+        try:
+            try:
+                cli.containers.get(dockName + "-bake").remove(force=True)  # interrupted bake
+            except docker.errors.NotFound:
+                pass
+            container = cli.containers.run(
+                base.id,
+                command=[posixpath.join(bakeDirInside, "init.sh"), "--bake"],
+                detach=True,
+                name=dockName + "-bake",
+                labels={"alidock.bake": dockName},
+                mounts=[Mount(self.aliDock.dirInside,
+                              os.path.expanduser(self.aliDock.conf["dirOutside"]), type="bind")])
+            exitCode = container.wait(timeout=float(self.aliDock.conf["startTimeout"]))
+            with open(os.path.join(bakeDir, "log.txt"), "wb") as fil:
+                fil.write(container.logs())
+            if exitCode["StatusCode"] != 0:
+                raise AliDockError("the init script failed with exit code {code}, check the log "
+                                   "file {log}".format(code=exitCode["StatusCode"],
+                                                       log=os.path.join(bakeDir, "log.txt")))
+            container.commit(repository=repository, tag=tag, changes=self.getChanges(base))
+        except (docker.errors.APIError, RequestException, IOError, OSError) as exc:
+            raise AliDockError("cannot bake {repository}:{tag}: {msg}".format(
+                repository=repository, tag=tag, msg=exc))
+        finally:
+            if container:
+                try:
+                    container.remove(force=True)
+                except docker.errors.APIError:
+                    pass
+
+    @TRACE.traced("bake")
+    def bake(self):
+        """Bake the user's image on top of the configured one, tagged with the base image ID and the
+           configuration fingerprint. Returns the name of the baked image, and whether it was baked
+           now (False if up to date)."""
+        import docker
+        from alidock.dockerapi import DockerApiError
+        try:
+            base = self.aliDock.cli.images.get(self.aliDock.conf["imageName"])
+        except docker.errors.ImageNotFound:
+            raise AliDockError("cannot bake: {image} is not available locally"
+                               .format(image=self.aliDock.conf["imageName"]))
+        fingerprint = self.aliDock.getFingerprint(withImage=False)
+        repository = BAKED_REPOSITORY.format(userId=getUserId())
+        tag = "{base}-{fingerprint}".format(base=base.id.split(":")[-1][:12],
+                                            fingerprint=fingerprint[:12])
+        imageName = repository + ":" + tag
+        record = self.loadRecord() or {}
+        try:
+            if record.get("image") == imageName and self.aliDock.api.inspectImage(imageName):
+                return imageName, False
+        except DockerApiError as exc:
+            raise AliDockError(str(exc))
+        self.commitInit(base, repository, tag)
+
+        # Images baked on top of the previous image or configuration are not needed anymore
+        if record.get("image") and record["image"] != imageName:
+            try:
+                self.aliDock.cli.images.remove(record["image"])
+            except docker.errors.APIError:
+                pass  # still used by a container
+        self.saveRecord({"image": imageName, "baseImage": self.aliDock.conf["imageName"],
+                         "baseImageId": base.id, "fingerprint": fingerprint, "baked": int(time())})
+        return imageName, True
@@ -0,0 +1,126 @@
+"""Batch execution of commands in the container, through a long-lived session: see `alidock exec
+--batch`. Commands are read one per line, results are written as one JSON object per line."""
+
+import json
+import os
+import subprocess
+import sys
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from time import time
+from alidock.log import LOG
+from alidock.trace import saveHostSpans
+from alidock.transport import getDockerExecCommand
+from alidock.util import AliDockError, installHelper
+
+class BatchSession(object):
+    """Session with the execution agent in the container (helpers/exec-agent.sh), started with the
+       given command. All commands run through the same process: with SSH connection sharing, no
+       new connection nor authentication is needed either."""
+
+    def __init__(self, agentCmd):
+        self.proc = subprocess.Popen(agentCmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def run(self, command):
+        """Run command in the container. Returns a tuple with exit code, output and error (bytes).
+           Raises AliDockError if the session is lost."""
+        cmd = command.encode("utf-8")
+        try:
+            self.proc.stdin.write(str(len(cmd)).encode("utf-8") + b"\n" + cmd)
+            self.proc.stdin.flush()
+            header = self.proc.stdout.readline().split()
+            exitCode, outLen, errLen = [int(x) for x in header]
+            out = self.proc.stdout.read(outLen)
+            err = self.proc.stdout.read(errLen)
+        except (IOError, OSError, ValueError):
+            raise AliDockError("lost connection with the execution agent in the container")
+        if len(out) != outLen or len(err) != errLen:
+            raise AliDockError("lost connection with the execution agent in the container")
+        return exitCode, out, err
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+
+def serveCommands(session, inp, out):
+    """Run each command read from the binary stream inp (one per line, empty lines are skipped),
+       writing to the binary stream out the result of each one as soon as it is available."""
+    for line in inp:
+        command = line.decode("utf-8", "replace").rstrip("\r\n")
+        if not command.strip():
+            continue
+        start = time()
+        exitCode, stdout, stderr = session.run(command)
+        result = {"command": command,
+                  "exitCode": exitCode,
+                  "stdout": stdout.decode("utf-8", "replace"),
+                  "stderr": stderr.decode("utf-8", "replace"),
+                  "seconds": round(time() - start, 6)}
+        out.write((json.dumps(result) + "\n").encode("utf-8"))
+        out.flush()
+
+class BatchServer(ThreadingMixIn, UnixStreamServer):
+    """Accept batches of commands on a Unix socket. Each client gets its own session, so clients
+       are served concurrently."""
+
+    daemon_threads = True
+
+    def __init__(self, sockPath, agentCmd):
+        self.agentCmd = agentCmd
+        try:
+            os.unlink(sockPath)  # stale socket from a previous server
+        except OSError:
+            pass
+        oldUmask = os.umask(0o077)  # only the current user can connect
+        try:
+            UnixStreamServer.__init__(self, sockPath, BatchRequestHandler)
+        finally:
+            os.umask(oldUmask)
+
+class BatchRequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        session = BatchSession(self.server.agentCmd)
+        try:
+            serveCommands(session, self.rfile, self.wfile)
+        except (AliDockError, IOError, OSError):
+            pass  # client or agent went away
+        finally:
+            session.close()
+
+def execBatch(aliDock, sockPath=None):
+    """Run the commands read from stdin, or sent by the clients of the Unix socket sockPath, in the
+       container of aliDock through a long-lived session with an execution agent. Results are
+       written as JSON lines."""
+    agentInside = installHelper(aliDock, "exec-agent.sh")
+    if aliDock.conf["transport"] == "docker":
+        agentCmd = getDockerExecCommand(aliDock, ["bash", agentInside], tty=False)
+    else:
+        agentCmd = aliDock.getSshCommand() + ["-x", "-T", "bash", agentInside]
+    saveHostSpans(aliDock.getRunDir())
+
+    if not sockPath:
+        session = BatchSession(agentCmd)
+        try:
+            serveCommands(session, sys.stdin.buffer, sys.stdout.buffer)
+        finally:
+            session.close()
+        return
+
+    try:
+        server = BatchServer(sockPath, agentCmd)
+    except (IOError, OSError) as exc:
+        raise AliDockError("cannot listen on {sock}: {msg}".format(sock=sockPath, msg=exc))
+    LOG.info("Accepting commands on {sock}, stop with Ctrl-C".format(sock=sockPath))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(sockPath)
+        except OSError:
+            pass
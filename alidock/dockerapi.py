@@ -0,0 +1,116 @@
+"""Minimal Docker Engine API client used by the code paths which must be fast, such as `alidock
+status`: importing the Docker SDK takes much longer than the few requests they perform."""
+
+import json
+import os
+import platform
+import socket
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import quote, urlencode
+from alidock.util import AliDockError
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+class DockerApiError(AliDockError):
+    """Error communicating with the Docker daemon, or reported by it."""
+
+def getDockerSocket():
+    """Return the path to the Unix socket of the Docker daemon, as configured with DOCKER_HOST. If
+       the daemon is not reachable through a Unix socket (TCP, TLS, Windows named pipes...) None is
+       returned: the Docker SDK must be used instead."""
+    if platform.system() == "Windows":
+        return None
+    dockerHost = os.environ.get("DOCKER_HOST")
+    if not dockerHost:
+        return DEFAULT_SOCKET
+    if dockerHost.startswith("unix://"):
+        return dockerHost[len("unix://"):]
+    return None
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP connection through a Unix socket."""
+
+    def __init__(self, sockPath, timeout):
+        HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.sockPath = sockPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.sockPath)
+
+class MiniDockerClient(object):
+    """Read-only Docker client performing unversioned requests (i.e. using the latest API version
+       supported by the daemon) without any version negotiation. One connection is kept open."""
+
+    def __init__(self, sockPath, timeout=10):
+        self.conn = UnixHTTPConnection(sockPath, timeout)
+
+    def get(self, path, **query):
+        """Perform a GET request and return the decoded JSON answer, or None if the object is not
+           found. Raises DockerApiError on communication errors."""
+        url = path + ("?" + urlencode(query) if query else "")
+        try:
+            self.conn.request("GET", url)
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (HTTPException, socket.error, OSError) as exc:
+            self.conn.close()
+            raise DockerApiError("cannot communicate to Docker, is it running? Full error: "
+                                 "{msg}".format(msg=exc))
+        if resp.status == 404:
+            return None
+        try:
+            payload = json.loads(data.decode("utf-8"))
+        except ValueError:
+            payload = {}
+        if resp.status != 200:
+            raise DockerApiError("Docker error: {msg}".format(
+                msg=payload.get("message", resp.reason) if isinstance(payload, dict) else
+                resp.reason))
+        return payload
+
+    def inspectContainer(self, name):
+        return self.get("/containers/{name}/json".format(name=quote(name, safe="")))
+
+    def inspectImage(self, name):
+        return self.get("/images/{name}/json".format(name=quote(name, safe="/:")))
+
+    def listContainers(self, filters):
+        return self.get("/containers/json", all="1", filters=json.dumps(filters))
+
+    def stats(self, name):
+        # one-shot: do not wait for a second sample to compute CPU usage (ignored by old daemons)
+        return self.get("/containers/{name}/stats".format(name=quote(name, safe="")),
+                        stream="false", **{"one-shot": "true"})
+
+class SdkDockerClient(object):
+    """Same interface as MiniDockerClient, implemented with the Docker SDK."""
+
+    def __init__(self, client):
+        self.api = client.api
+
+    def call(self, func, *args, **kwargs):
+        import docker
+        from requests.exceptions import RequestException
+        try:
+            return func(*args, **kwargs)
+        except docker.errors.NotFound:
+            return None
+        except docker.errors.APIError as exc:
+            raise DockerApiError("Docker error: {msg}".format(msg=exc))
+        except RequestException as exc:
+            raise DockerApiError("cannot communicate to Docker, is it running? Full error: "
+                                 "{msg}".format(msg=exc))
+
+    def inspectContainer(self, name):
+        return self.call(self.api.inspect_container, name)
+
+    def inspectImage(self, name):
+        return self.call(self.api.inspect_image, name)
+
+    def listContainers(self, filters):
+        return self.call(self.api.containers, all=True, filters=filters)
+
+    def stats(self, name):
+        return self.call(self.api.stats, name, stream=False)
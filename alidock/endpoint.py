@@ -0,0 +1,172 @@
+"""SSH endpoint of the alidock container, saved in the run directory shared with it: the hot path of
+`enter` and `exec` uses it without contacting Docker. The readiness of a new container is detected
+with file checks and by probing the SSH banner, without forking ssh."""
+
+import json
+import os
+import os.path
+import socket
+from time import time, sleep
+from alidock.trace import TRACE
+from alidock.util import AliDockError
+
+def probeSshBanner(port):
+    """Check whether an SSH server answers on the given local port by reading its banner. A mere TCP
+       connection is not enough, as the Docker proxy accepts them even if nothing listens inside
+       the container."""
+    try:
+        sock = socket.create_connection(("127.0.0.1", int(port)), timeout=0.5)
+    except (socket.error, OSError):
+        return False
+    try:
+        return sock.recv(4) == b"SSH-"
+    except (socket.error, OSError):
+        return False
+    finally:
+        sock.close()
+
+def waitSshPort(readyFile, sshPort, timeout):
+    """Wait at most timeout seconds for readyFile to appear (if not None), then for an SSH server to
+       answer on sshPort."""
+    deadline = time() + float(timeout)
+    while True:
+        if readyFile is None or os.path.isfile(readyFile):
+            if probeSshBanner(sshPort):
+                return True
+        if time() > deadline:
+            return False
+        sleep(0.05)
+
+class Endpoint(object):
+    """Endpoint of the container of the given AliDock object. When expectReady is set, the container
+       was just started: its init script signals when it is ready with files in the run
+       directory."""
+
+    def __init__(self, aliDock):
+        self.aliDock = aliDock
+        self.info = None
+        self.expectReady = False
+
+    def save(self, attrs):
+        """Extract the SSH endpoint of the container from its Docker attributes, and save it in the
+           shared run directory for subsequent alidock invocations. Raises KeyError if the SSH port
+           is not (yet) available."""
+        ports = attrs["NetworkSettings"]["Ports"]
+        outPath = self.aliDock.getRunDir()
+
+        # Private key path detection. Older versions of alidock use different paths: do not break!
+        privKey = os.path.join(outPath, "ssh", "alidock.pem")
+        oldPrivKey = os.path.join(os.path.expanduser(self.aliDock.conf["dirOutside"]),
+                                  ".alidock-ssh", "alidock.pem")
+        if not os.path.isfile(privKey) and os.path.isfile(oldPrivKey):
+            privKey = oldPrivKey
+
+        xPort = ports.get("14500/tcp")
+        self.info = {"containerId": attrs["Id"],
+                     "sshPort": ports["22/tcp"][0]["HostPort"],
+                     "xPort": xPort[0]["HostPort"] if xPort else None,
+                     "privKey": privKey}
+        try:
+            with open(os.path.join(outPath, "endpoint.json"), "w") as fil:
+                fil.write(json.dumps(self.info))
+        except (IOError, OSError):
+            pass  # not fatal: we will ask Docker next time
+        return self.info
+
+    def clear(self):
+        self.info = None
+        for fileName in ["endpoint.json", "ready", "ready-env", "frozen.json", "kept"]:
+            try:
+                os.unlink(os.path.join(self.aliDock.getRunDir(), fileName))
+            except OSError:
+                pass
+
+    def isControlMasterUp(self):
+        """Cheaply check whether the SSH master connection to the container is alive by connecting
+           to its control socket. The master goes away with the container it was connected to."""
+        if not hasattr(socket, "AF_UNIX"):
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member
+        sock.settimeout(0.5)
+        try:
+            sock.connect(os.path.join(self.aliDock.getRunDir(), "ssh", "control"))
+        except (socket.error, OSError):
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def load(self):
+        """Load the SSH endpoint saved by a previous invocation without contacting Docker. Returns
+           True only if the endpoint is known to be valid, i.e. there is a live SSH master
+           connection to the container."""
+        if not self.isControlMasterUp():
+            return False
+        try:
+            with open(os.path.join(self.aliDock.getRunDir(), "endpoint.json")) as fil:
+                endpoint = json.loads(fil.read())
+            if not os.path.isfile(endpoint["privKey"]):
+                return False
+            self.info = {k: endpoint[k] for k in ["containerId", "sshPort", "xPort", "privKey"]}
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def isReady(self):
+        """Cheaply check whether the container is running and can execute commands right away with
+           the configured transport, without loading the Docker SDK."""
+        if os.path.isfile(os.path.join(self.aliDock.getRunDir(), "frozen.json")):
+            return False  # paused: it must be resumed first
+        if self.aliDock.conf["transport"] == "docker":
+            from alidock.dockerapi import DockerApiError
+            try:
+                attrs = self.aliDock.api.inspectContainer(self.aliDock.conf["dockName"])
+            except DockerApiError:
+                return False
+            return bool(attrs) and (attrs.get("State") or {}).get("Status") == "running"
+        return self.load()
+
+    def get(self):
+        """Return the SSH endpoint of the running container. It is fetched from Docker only if it
+           was not loaded before. Raises AliDockError if the endpoint cannot be determined."""
+        if self.info is None:
+            state = self.aliDock.getContainerState()
+            if not state:
+                raise AliDockError("container {name} not found".format(
+                    name=self.aliDock.conf["dockName"]))
+            try:
+                self.save(state.attrs)
+            except (KeyError, IndexError, TypeError) as exc:
+                raise AliDockError("no SSH port: {msg}".format(msg=exc))
+        return self.info
+
+    @TRACE.traced("waitSshUp")
+    def waitSshUp(self):
+        """Wait until the SSH server in the container is ready, for at most startTimeout seconds.
+           For containers we have just started, we first wait for the init script to signal that it
+           is about to start sshd, which does not cost anything but a file check. The SSH banner is
+           then probed without spawning any ssh process."""
+        readyFile = os.path.join(self.aliDock.getRunDir(), "ready") if self.expectReady else None
+        return waitSshPort(readyFile, self.get()["sshPort"], self.aliDock.conf["startTimeout"])
+
+    @TRACE.traced("waitEnvUp")
+    def waitEnvUp(self):
+        """Wait until the init script of the container we have just started has created the user
+           and its environment, for at most startTimeout seconds. This is all the Docker exec
+           transport needs: it does not wait for the SSH server."""
+        if not self.expectReady:
+            return
+        readyFile = os.path.join(self.aliDock.getRunDir(), "ready-env")
+        deadline = time() + float(self.aliDock.conf["startTimeout"])
+        while not os.path.isfile(readyFile):
+            if time() > deadline:
+                raise AliDockError("container did not initialize in time, check the log file {log}"
+                                   .format(log=os.path.join(self.aliDock.getRunDir(), "log.txt")))
+            sleep(0.02)
+
+    def waitUp(self):
+        """Wait until the container can execute commands with the configured transport."""
+        if self.aliDock.conf["transport"] == "docker":
+            self.waitEnvUp()
+        else:
+            self.waitSshUp()
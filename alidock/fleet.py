@@ -0,0 +1,85 @@
+"""Fleet mode: start, stop or report the status of several alidock containers at once, each one
+handled by its own AliDock object. Operations are performed concurrently, and their timings
+reported."""
+
+import json
+from alidock.keep import isStopped, restartKept
+from alidock.log import LOG
+from alidock.pool import WarmPool
+from alidock.status import getStatus
+from alidock.util import parallelMap, spawnDetached
+
+FLEET_WORKERS = 8  # concurrent Docker operations in fleet mode (Docker client has 10 connections)
+
+def startFleetMember(member):
+    """Start the container of a fleet member if not running. Returns a description of what was
+       done."""
+    if member.isRunning():
+        if not isStopped(member):
+            return "already running"
+        if restartKept(member):
+            return "restarted"
+    warmPool = int(member.conf["warmPool"]) > 0
+    if warmPool and WarmPool(member).claim():
+        result = "started from the warm pool"
+    else:
+        member.run()
+        result = "created"
+    if warmPool:
+        spawnDetached("fillWarmPoolDetached", member.exportConf())
+    return result
+
+def stopFleetMember(member, keep):
+    """Stop the container of a fleet member, keeping it if requested. Returns a description of what
+       was done."""
+    member.stop(keep)
+    return "stopped and kept" if keep else "stopped"
+
+def printFleetStatus(names, fleet, withStats):
+    """Print the full status of each fleet member as JSON, fetched concurrently. Returns whether all
+       of them are running."""
+    statuses = []
+    results = parallelMap(lambda member: getStatus(member, withStats), fleet, FLEET_WORKERS)
+    for name, (status, exc, _) in zip(names, results):
+        statuses.append(status if exc is None else {"name": name, "running": False,
+                                                    "error": str(exc)})
+    print(json.dumps(statuses, indent=2, sort_keys=True))
+    return all(status["running"] for status in statuses)
+
+def logFleetStatus(names, instances, getMember):
+    """Report the status of the containers with the given names, as listed by a single Docker API
+       request (see AliDock.listInstances). Containers started by older alidock versions have no
+       labels: their status is asked to the AliDock object returned by getMember for their name.
+       Returns whether all of them are running."""
+    instances = {inst["name"]: inst for inst in instances}
+    names = names or sorted(instances)
+    running = 0
+    for name in names:
+        inst = instances.get(name)
+        if not inst:
+            status = getStatus(getMember(name))
+            if status["id"]:
+                inst = {"image": status["image"], "status": status["state"]}
+        if inst and inst["status"] == "running":
+            running += 1
+            LOG.info("{name}: running (image: {image})".format(name=name, image=inst["image"]))
+        elif inst:
+            LOG.warning("{name}: {status}".format(name=name, status=inst["status"]))
+        else:
+            LOG.error("{name}: not running".format(name=name))
+    if not names:
+        LOG.error("No alidock container found")
+    return bool(running) and running == len(names)
+
+def logFleetResults(names, results):
+    """Report the results of an operation on the containers with the given names, as returned by
+       parallelMap. Returns the number of failed operations."""
+    failed = 0
+    for name, (result, exc, seconds) in zip(names, results):
+        if exc is None:
+            LOG.info("{name}: {result} ({sec:.2f} s)".format(name=name, result=result, sec=seconds))
+        else:
+            failed += 1
+            LOG.error("{name}: failed after {sec:.2f} s: {msg}".format(name=name, msg=exc,
+                                                                       sec=seconds))
+    return failed
@@ -0,0 +1,154 @@
+"""Freezing of idle containers: see `alidock freeze`. Frozen (paused) containers do not use the CPU,
+and their memory is the first the kernel reclaims under pressure. They are resumed as soon as they
+are needed."""
+
+import json
+import os
+import os.path
+from time import time
+from alidock.log import LOG
+from alidock.pool import getContainerRunDir
+from alidock.util import AliDockError
+
+class Freezer(object):
+    """Freezes and resumes the container of the given AliDock object. The container is marked as
+       frozen in the run directory, so that the hot path of `exec` never uses a paused one."""
+
+    def __init__(self, aliDock):
+        self.aliDock = aliDock
+        self.frozenPath = os.path.join(aliDock.getRunDir(), "frozen.json")
+
+    def getLastActivity(self, state):
+        """Time of the last user activity in the container described by state (processes of the
+           user other than the SSH server and xpra), as recorded every minute by its init script.
+           None if unknown."""
+        try:
+            with open(os.path.join(getContainerRunDir(self.aliDock, state), "active")) as fil:
+                return int(fil.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def getFrozenInfo(self):
+        """Return the time the container was frozen and its memory usage at that time as a dict, or
+           None if it was not frozen by `alidock freeze`."""
+        try:
+            with open(self.frozenPath) as fil:
+                return json.loads(fil.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def getMemoryUsage(self, containerId):
+        """Memory used by the container in bytes, excluding the inactive page cache (the kernel
+           reclaims it first), or None if Docker does not report it."""
+        from alidock.dockerapi import DockerApiError
+        try:
+            memStats = (self.aliDock.api.stats(containerId) or {}).get("memory_stats") or {}
+        except DockerApiError:
+            return None
+        if memStats.get("usage") is None:
+            return None
+        stats = memStats.get("stats") or {}
+        return memStats["usage"] - stats.get("inactive_file", stats.get("total_inactive_file", 0))
+
+    def freezeIfIdle(self, idleTimeout):
+        """Pause the container if it has been idle for more than idleTimeout seconds. Returns a dict
+           describing the state of the container ("state": "frozen" if it was just paused) with its
+           idle time and memory usage."""
+        import docker
+        state = self.aliDock.getContainerState()
+        if not state:
+            return {"state": "not running"}
+        frozen = self.getFrozenInfo()
+        if state.status == "paused" and frozen:
+            return {"state": "already frozen", "idleSeconds": int(time()) - frozen["pausedAt"],
+                    "memoryAtFreeze": frozen["memoryBytes"],
+                    "memoryBytes": self.getMemoryUsage(state.containerId)}
+        if state.status != "running":
+            return {"state": state.status}
+        lastActivity = self.getLastActivity(state)
+        if lastActivity is None:
+            return {"state": "unknown activity"}  # started by an older alidock version
+        idleSeconds = max(0, int(time()) - lastActivity)
+        if idleSeconds < int(idleTimeout):
+            return {"state": "active", "idleSeconds": idleSeconds}
+
+        memory = self.getMemoryUsage(state.containerId)
+        # Marked as frozen first: the hot path of `exec` must never try to use a paused container
+        with open(self.frozenPath, "w") as fil:
+            fil.write(json.dumps({"pausedAt": int(time()), "memoryBytes": memory}))
+        try:
+            state.container.pause()
+        except docker.errors.APIError as exc:
+            os.unlink(self.frozenPath)
+            raise AliDockError("cannot pause {name}: {msg}".format(
+                name=self.aliDock.conf["dockName"], msg=exc))
+        self.aliDock.invalidateContainerState()
+        return {"state": "frozen", "idleSeconds": idleSeconds, "memoryBytes": memory}
+
+    def unfreeze(self):
+        """Resume the container if it is paused, e.g. frozen by `alidock freeze`: this is much
+           faster than starting a new one. Returns True if the container was resumed."""
+        import docker
+        state = self.aliDock.getContainerState()
+        resumed = False
+        if state and state.status == "paused":
+            try:
+                state.container.unpause()
+            except docker.errors.APIError as exc:
+                raise AliDockError("cannot resume {name}: {msg}".format(
+                    name=self.aliDock.conf["dockName"], msg=exc))
+            state.attrs["State"].update({"Status": "running", "Paused": False})  # no new inspect
+            resumed = True
+            try:
+                # Do not freeze it again before the init script notices the new session
+                activeFile = os.path.join(getContainerRunDir(self.aliDock, state), "active")
+                with open(activeFile, "w") as fil:
+                    fil.write(str(int(time())))
+            except (IOError, OSError):
+                pass
+        try:
+            os.unlink(self.frozenPath)
+        except OSError:
+            pass
+        return resumed
+
+def mib(num):
+    return (num or 0) / 1048576.
+
+def logFreezeResult(name, result):
+    """Report the result of Freezer.freezeIfIdle for the container with the given name."""
+    if result["state"] == "frozen":
+        LOG.info("{name}: frozen after {min} min idle, holding {mem:.1f} MiB".format(
+            name=name, min=result["idleSeconds"] // 60, mem=mib(result["memoryBytes"])))
+    elif result["state"] == "already frozen":
+        LOG.info("{name}: frozen for {min} min, holding {mem:.1f} MiB ({frz:.1f} MiB when "
+                 "frozen)".format(name=name, min=result["idleSeconds"] // 60,
+                                  mem=mib(result["memoryBytes"]),
+                                  frz=mib(result["memoryAtFreeze"])))
+    elif result["state"] == "active":
+        LOG.info("{name}: active {min} min ago".format(name=name, min=result["idleSeconds"] // 60))
+    else:
+        LOG.info("{name}: {state}".format(name=name, state=result["state"]))
+
+def logFreezeResults(names, results):
+    """Report the results of Freezer.freezeIfIdle for the containers with the given names, as
+       returned by parallelMap: the memory held by the frozen containers, and how much of it the
+       kernel has reclaimed since they were frozen. Returns the number of failed checks."""
+    frozen, held, reclaimed, failed = 0, 0, 0, 0
+    for name, (result, exc, _) in zip(names, results):
+        if exc is not None:
+            failed += 1
+            LOG.error("{name}: {msg}".format(name=name, msg=exc))
+            continue
+        logFreezeResult(name, result)
+        if result["state"] == "frozen":
+            frozen += 1
+        if result["state"] in ["frozen", "already frozen"]:
+            held += result["memoryBytes"] or 0
+        if result["state"] == "already frozen" and result["memoryAtFreeze"] is not None and \
+           result["memoryBytes"] is not None:
+            reclaimed += max(0, result["memoryAtFreeze"] - result["memoryBytes"])
+    LOG.info("Froze {frozen} container(s); frozen containers hold {held:.1f} MiB, {rec:.1f} MiB "
+             "were reclaimed by the kernel since they were frozen".format(
+                 frozen=frozen, held=mib(held), rec=mib(reclaimed)))
+    return failed
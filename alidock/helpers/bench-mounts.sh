@@ -0,0 +1,57 @@
+#!/bin/bash
+
+# Mount microbenchmark for `alidock bench-mounts`, running inside the container. Auto-generated.
+#
+# For each writable directory given as argument, measures the rate of small file creations, stats
+# and removals (metadata), and the sequential write and read throughput of a large file. Sizes can
+# be changed with ALIDOCK_BENCH_FILES (number of small files) and ALIDOCK_BENCH_MB (large file).
+
+FILES=${ALIDOCK_BENCH_FILES:-2000}
+SIZE_MB=${ALIDOCK_BENCH_MB:-256}
+
+function _now() {
+  date +%s%N
+}
+
+function _rate() {
+  # Operations per second, given the number of operations and the start time in nanoseconds
+  local ELAPSED=$(( $(_now) - $2 ))
+  echo $(( $1 * 1000000000 / (ELAPSED > 0 ? ELAPSED : 1) ))
+}
+
+printf '%-28s %-12s %10s %10s %10s %10s %10s\n' \
+       "mount" "type" "create/s" "stat/s" "remove/s" "write MB/s" "read MB/s"
+for DIR in "$@"; do
+  [[ -d $DIR && -w $DIR ]] || continue
+  WORK=$(mktemp -d "$DIR/.alidock-bench.XXXXXX") || continue
+  trap 'rm -rf "$WORK"' EXIT
+
+  START=$(_now)
+  for ((I = 0; I < FILES; I++)); do
+    echo "$I" > "$WORK/f$I"
+  done
+  CREATE=$(_rate "$FILES" "$START")
+
+  START=$(_now)
+  for ((I = 0; I < FILES; I++)); do
+    [[ -e $WORK/f$I ]]
+  done
+  STAT=$(_rate "$FILES" "$START")
+
+  START=$(_now)
+  ( cd "$WORK" && rm -f f* )
+  REMOVE=$(_rate "$FILES" "$START")
+
+  # Write through to the storage, and read bypassing the page cache where possible
+  START=$(_now)
+  dd if=/dev/zero of="$WORK/big" bs=1M count="$SIZE_MB" conv=fsync &> /dev/null
+  WRITE=$(_rate "$SIZE_MB" "$START")
+  START=$(_now)
+  dd if="$WORK/big" of=/dev/null bs=1M iflag=direct &> /dev/null || \
+    dd if="$WORK/big" of=/dev/null bs=1M &> /dev/null
+  READ=$(_rate "$SIZE_MB" "$START")
+
+  rm -rf "$WORK"
+  printf '%-28s %-12s %10d %10d %10d %10d %10d\n' \
+         "$DIR" "$(stat -f -c %T "$DIR")" "$CREATE" "$STAT" "$REMOVE" "$WRITE" "$READ"
+done
@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Batch execution agent for `alidock exec --batch`, running inside the container. Auto-generated.
+#
+# Reads commands from stdin, each one as its length in bytes on a line followed by the command
+# itself. Every command runs in its own subshell with no input. Its exit code and the lengths of its
+# standard output and error are written on a line, followed by the output and the error.
+
+export LC_ALL=C  # lengths are in bytes
+OUT=$(mktemp)
+ERR=$(mktemp)
+trap 'rm -f "$OUT" "$ERR"' EXIT
+cd
+
+while read -r LEN; do
+  CMD=
+  [[ $LEN -gt 0 ]] && read -r -d '' -N "$LEN" CMD
+  ( eval "$CMD" ) < /dev/null > "$OUT" 2> "$ERR"
+  RC=$?
+  printf '%d %d %d\n' "$RC" "$(stat -c %s "$OUT")" "$(stat -c %s "$ERR")"
+  cat "$OUT" "$ERR"
+done
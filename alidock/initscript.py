@@ -0,0 +1,138 @@
+"""Preparation of new containers on the host: the SSH keys, the parameters of the init script and
+its rendering from the template, and the shared directory on macOS."""
+
+import errno
+import hashlib
+import json
+import os
+import os.path
+import posixpath
+import subprocess
+from io import open
+from alidock.mounts import parseMounts, getSyncMounts
+from alidock.util import AliDockError, getUserId, getRocmVideoGid, parseSize, readHelper
+
+def ensureSshKeys(aliDock):
+    """Generate the SSH keys of the user and of the server on the host, only if they do not
+       exist or were generated for a different container name or user. Keys are shared by all
+       the containers with the same name, including the ones in the warm pool."""
+    keyDir = os.path.join(aliDock.getRunDir(), "ssh")
+    keyFiles = ["alidock.pem", "alidock.pub", "ssh_host_ed25519_key",
+                "ssh_host_ed25519_key.pub"]
+    keysId = "{dockName} {userName}".format(dockName=aliDock.conf["dockName"],
+                                            userName=aliDock.userName)
+    try:
+        with open(os.path.join(keyDir, "keys.id")) as fil:
+            if fil.read().strip() == keysId and \
+               all(os.path.isfile(os.path.join(keyDir, k)) for k in keyFiles):
+                return
+    except (IOError, OSError):
+        pass
+
+    try:
+        try:
+            os.makedirs(keyDir)
+        except OSError as exc:
+            if not os.path.isdir(keyDir) or exc.errno != errno.EEXIST:
+                raise
+        for keyFile in keyFiles + ["alidock.pem.pub", "keys.id"]:
+            try:
+                os.unlink(os.path.join(keyDir, keyFile))
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+        nul = open(os.devnull, "w")
+        for keyFile, comment in [("alidock.pem", aliDock.userName), ("ssh_host_ed25519_key", "")]:
+            subprocess.check_call(["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-C", comment,
+                                   "-f", os.path.join(keyDir, keyFile)], stdout=nul, stderr=nul)
+        os.rename(os.path.join(keyDir, "alidock.pem.pub"), os.path.join(keyDir, "alidock.pub"))
+        with open(os.path.join(keyDir, "keys.id"), "w") as fil:
+            fil.write(keysId + "\n")
+    except (OSError, subprocess.CalledProcessError) as exc:
+        raise AliDockError("cannot generate SSH keys in {dir}: {msg}".format(dir=keyDir,
+                                                                             msg=exc))
+
+def initDarwin(outDir):
+    """macOS only: exclude the "sw" directory of the shared directory outDir from indexing and
+       backup."""
+    swDir = os.path.join(outDir, ".sw")
+    swNoidx = os.path.join(outDir, ".sw.noindex")
+    if os.path.isdir(swDir) and not os.path.islink(swDir) and not os.path.exists(swNoidx):
+        # An old installation uses .sw: rename to .sw.noindex
+        os.rename(swDir, swNoidx)
+    try:
+        # Create .sw.noindex (not indexed by Spotlight because of `.noindex`)
+        os.mkdir(swNoidx)
+    except OSError as exc:
+        if not os.path.isdir(swNoidx) or exc.errno != errno.EEXIST:
+            raise AliDockError("cannot create {dir}".format(dir=swNoidx))
+    try:
+        # Symlink .sw -> .sw.noindex
+        os.symlink(".sw.noindex", swDir)
+    except OSError as exc:
+        if not os.path.islink(swDir) or exc.errno != errno.EEXIST:
+            raise AliDockError("cannot symlink .sw -> .sw.noindex %s" % str(exc))
+    try:
+        # Exclude .sw.noindex from Time Machine backups (check with `xattr`)
+        nul = open(os.devnull, "w")
+        subprocess.check_call(["tmutil", "addexclusion", swNoidx], stdout=nul, stderr=nul)
+    except subprocess.CalledProcessError as exc:
+        raise AliDockError("cannot exclude {dir} from Time Machine backups, "
+                           "tmutil returned {ret}".format(dir=swNoidx, ret=exc.returncode))
+
+def getInitParams(aliDock, runDirInside):
+    """Parameters of the init script template, for a container using runDirInside as its run
+       directory. Raises AliDockError if the configuration is not valid."""
+    # {"groupname": gid} added inside the container (gid=None == I don't care). The video group
+    # is only there with ROCm devices
+    addGroups = {"video": getRocmVideoGid()}
+    if aliDock.conf["enableRocmDevices"] and not addGroups["video"]:
+        raise AliDockError("cannot enable ROCm: check your ROCm installation")
+    if not aliDock.conf["enableRocmDevices"]:
+        del addGroups["video"]
+
+    # Build cache: half of it for ccache (which evicts by itself), half for the tarball store
+    cacheSize = None
+    if aliDock.conf["buildCache"]:
+        try:
+            cacheSize = parseSize(aliDock.conf["buildCacheSize"])
+        except ValueError:
+            raise AliDockError("invalid build cache size {size}, use e.g. 20G"
+                               .format(size=aliDock.conf["buildCacheSize"]))
+
+    if aliDock.conf["homeMountProfile"] not in ["cached", "delegated", "consistent"]:
+        raise AliDockError("invalid home mount profile {profile}: use cached, delegated or "
+                           "consistent".format(profile=aliDock.conf["homeMountProfile"]))
+
+    return {"sharedDir": aliDock.dirInside,
+            "runDir": runDirInside,
+            "keyDir": posixpath.join(aliDock.getRunDirInside(), "ssh"),
+            "dockName": aliDock.conf["dockName"].rsplit("-", 1)[0],
+            "userName": aliDock.userName,
+            "userId": getUserId(),
+            "useWebX11": aliDock.conf["web"],
+            "cacheSize": cacheSize,
+            "syncMounts": getSyncMounts(parseMounts(aliDock.conf["mount"])),
+            "activeFile": posixpath.join(runDirInside, "active"),
+            "addGroups": addGroups}
+
+def renderInitSh(initShPath, **params):
+    """Render the init.sh.j2 template with params to initShPath. The hash of the template and
+       of params is saved along with it: rendering, and importing Jinja, is skipped when the
+       existing script was rendered from the same inputs."""
+    template = readHelper("init.sh.j2")
+    renderKey = hashlib.sha1(template + json.dumps(params, sort_keys=True).encode("utf-8"))
+    renderKey = renderKey.hexdigest()
+    keyPath = initShPath + ".key"
+    try:
+        with open(keyPath) as fil:
+            if fil.read().strip() == renderKey and os.path.isfile(initShPath):
+                return
+    except (IOError, OSError):
+        pass
+    import jinja2
+    with open(initShPath, "w", newline="\n") as fil:
+        fil.write(jinja2.Template(template.decode("utf-8")).render(**params))
+    os.chmod(initShPath, 0o700)
+    with open(keyPath, "w") as fil:
+        fil.write(renderKey + "\n")
@@ -0,0 +1,60 @@
+"""Containers kept by `alidock stop --keep`: they are only stopped, and the next start restarts
+them if the configuration and the image did not change, without bootstrapping a new container."""
+
+import os.path
+from alidock.util import AliDockError
+
+def isStopped(aliDock):
+    """Whether the container exists but is not running, e.g. kept by `alidock stop --keep`."""
+    state = aliDock.getContainerState()
+    return bool(state) and state.status in ["created", "exited", "dead"]
+
+def getKeptId(aliDock):
+    """Return the ID of the container stopped by `alidock stop --keep`, or None."""
+    try:
+        with open(os.path.join(aliDock.getRunDir(), "kept")) as fil:
+            return fil.read().strip()
+    except (IOError, OSError):
+        return None
+
+def stopKept(aliDock, state):
+    """Stop the container described by state, and record it as kept: it is only restarted if
+       stopped this way, not if it exited by itself (e.g. its init script failed)."""
+    import docker
+    try:
+        state.container.stop()
+    except docker.errors.APIError as exc:
+        raise AliDockError("cannot stop {name}: {msg}".format(name=aliDock.conf["dockName"],
+                                                             msg=exc))
+    with open(os.path.join(aliDock.getRunDir(), "kept"), "w") as fil:
+        fil.write(state.containerId)
+
+def restartKept(aliDock):
+    """Start the stopped container again, if it was stopped by `alidock stop --keep` and created
+       with the current configuration and image: its init script finds the user, keys and
+       configuration already in place. Otherwise (e.g. its init script failed) the container is
+       removed, and False is returned."""
+    import docker
+    state = aliDock.getContainerState()
+    # Containers claimed from the warm pool have their own run directory: not restarted
+    if state.status == "dead" or getKeptId(aliDock) != state.containerId or \
+       state.labels.get("alidock.runDir") or \
+       state.labels.get("alidock.fingerprint") != aliDock.getFingerprint(withImage=False) or \
+       (state.labels.get("alidock.baseImageId") or state.attrs.get("Image")) != \
+       aliDock.getLocalImageId():
+        aliDock.stop()
+        return False
+    aliDock.endpoint.clear()
+    try:
+        state.container.start()
+        state.container.reload()  # host ports are assigned again
+    except docker.errors.APIError as exc:
+        raise AliDockError("cannot restart {name}: {msg}".format(name=aliDock.conf["dockName"],
+                                                                msg=exc))
+    aliDock.invalidateContainerState(state.container)
+    aliDock.endpoint.expectReady = True
+    try:
+        aliDock.endpoint.save(state.container.attrs)
+    except KeyError:
+        pass  # will be retrieved later on
+    return True
@@ -1,11 +1,18 @@
 import sys
-import colorama
 
 class Log(object):
 
     def __init__(self):
-        colorama.init()
         self.quiet = False
+        self.colorama = None
+
+    def getColorama(self):
+        # colorama is loaded and initialized upon first message to keep startup fast
+        if self.colorama is None:
+            import colorama
+            colorama.init()
+            self.colorama = colorama
+        return self.colorama
 
     def setQuiet(self, quiet=True):
         self.quiet = quiet
@@ -13,20 +20,37 @@ class Log(object):
     def printColor(self, colorCode, msg):
         if self.quiet:
             return
-        sys.stderr.write(colorCode)
+        colorama = self.getColorama()
+        sys.stderr.write(getattr(colorama.Fore, colorCode))
         sys.stderr.write(msg)
         sys.stderr.write(colorama.Style.RESET_ALL)
         sys.stderr.write("\n")
         sys.stderr.flush()
 
+    def progress(self, msg, final=False):
+        """Print a progress message. On a terminal, each message replaces the previous one: the
+        last one should be printed with final=True."""
+        if self.quiet:
+            return
+        if not sys.stderr.isatty():
+            self.info(msg)
+            return
+        colorama = self.getColorama()
+        sys.stderr.write("\r" + colorama.Fore.GREEN + msg + colorama.Style.RESET_ALL + "\033[K")
+        if final:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
     def debug(self, msg):
-        self.printColor(colorama.Fore.MAGENTA, msg)
+        self.printColor("MAGENTA", msg)
 
     def info(self, msg):
-        self.printColor(colorama.Fore.GREEN, msg)
+        self.printColor("GREEN", msg)
 
     def warning(self, msg):
-        self.printColor(colorama.Fore.YELLOW, msg)
+        self.printColor("YELLOW", msg)
 
     def error(self, msg):
-        self.printColor(colorama.Fore.RED, msg)
+        self.printColor("RED", msg)
+
+LOG = Log()  # shared by all the alidock modules
@@ -0,0 +1,118 @@
+"""User-defined mounts, given in the format /external/path[:label[:[rw|ro][:profile]]], and their
+profiles: bind mounts with a consistency (cached, delegated, consistent), Docker volumes synced
+back to the host periodically, or tmpfs."""
+
+import hashlib
+import os.path
+import platform
+import posixpath
+import re
+from alidock.util import AliDockError, splitEsc, getUserId, parseSize
+
+MOUNT_SYNC_PERIOD = 60  # default seconds between sync-backs of the mounts with the volume profile
+
+def parseProfile(label, profile, opt):
+    """Validate the profile of the mount with the given label and its option. Returns a tuple with
+       the profile (bind, volume or tmpfs) and its option: the bind consistency, the sync-back
+       period in seconds, or the tmpfs size in bytes."""
+    try:
+        if profile in ["cached", "delegated", "consistent"] and not opt:
+            return "bind", profile
+        if profile == "volume":
+            opt = int(opt or MOUNT_SYNC_PERIOD)
+            if opt <= 0:
+                raise ValueError("sync period must be positive")
+            return profile, opt
+        if profile == "tmpfs":
+            return profile, parseSize(opt) if opt else None
+        raise ValueError("unknown profile")
+    except ValueError:
+        raise AliDockError("invalid mount profile for {label}: use cached, delegated, "
+                           "consistent, volume[=SECONDS] or tmpfs[=SIZE]".format(label=label))
+
+def parseMount(mount):
+    """Parse a user-defined mount. Returns a dict with its source, target, label and mode, and its
+       profile with the profile option (see parseProfile). The source of tmpfs mounts is not
+       used."""
+    src, label, mode, profile = splitEsc(mount, ":", 3)
+    profile, _, opt = profile.partition("=")
+    profile = profile or "cached"
+    if profile == "tmpfs":
+        if not label:
+            raise AliDockError("tmpfs mounts need a label, e.g. :build:rw:tmpfs=8G")
+    else:
+        src = os.path.expanduser(src).rstrip("/")
+        if not src:
+            src = "/"
+        if os.path.isfile(src):
+            raise AliDockError("mount {src} is a file: only dirs allowed".format(src=src))
+        if not label:
+            label = "root" if src == "/" else os.path.basename(src)
+    if "/" in label or label in [".", ".."]:
+        raise AliDockError("mount label {label} is invalid: label cannot contain a slash"
+                           "and cannot be equal to \"..\" or \".\"".format(label=label))
+    if not mode:
+        mode = "rw"
+    if mode not in ["rw", "ro"]:
+        raise AliDockError("supported modes for mounts are \"rw\" and \"ro\", "
+                           "not {mode}".format(mode=mode))
+    profile, opt = parseProfile(label, profile, opt)
+    return {"source": src, "target": posixpath.join("/", "mnt", label), "label": label,
+            "readOnly": mode == "ro", "profile": profile, "option": opt}
+
+def parseMounts(specs):
+    """Parse the given user-defined mounts (see parseMount)."""
+    return [parseMount(mount) for mount in specs]
+
+def getDockerMounts(mounts):
+    """Docker mounts for the parsed user-defined mounts. The host directory of the mounts with the
+       volume profile is mounted under /mnt/.alidock-host: the init script keeps it in sync with
+       the volume."""
+    from docker.types import Mount
+    dockMounts = []
+    for mnt in mounts:
+        if mnt["profile"] == "bind":
+            dockMounts.append(Mount(mnt["target"], mnt["source"], type="bind",
+                                    read_only=mnt["readOnly"], consistency=mnt["option"]))
+        elif mnt["profile"] == "tmpfs":
+            dockMounts.append(Mount(mnt["target"], None, type="tmpfs",
+                                    tmpfs_size=mnt["option"], tmpfs_mode=0o1777))
+        else:
+            volume = "alidock-mnt-{userId}-{label}-{hash}".format(
+                userId=getUserId(), label=re.sub("[^a-zA-Z0-9_.-]", "_", mnt["label"]),
+                hash=hashlib.sha1(mnt["source"].encode("utf-8")).hexdigest()[:8])
+            dockMounts.append(Mount(mnt["target"], volume, type="volume"))
+            dockMounts.append(Mount(posixpath.join("/", "mnt", ".alidock-host", mnt["label"]),
+                                    mnt["source"], type="bind", read_only=mnt["readOnly"],
+                                    consistency="delegated"))
+    return dockMounts
+
+def getSyncMounts(mounts):
+    """Parameters of the init script for the parsed mounts with the volume profile: where the host
+       directory is mounted, and the sync-back period (None for read-only mounts)."""
+    return [{"host": posixpath.join("/", "mnt", ".alidock-host", mnt["label"]),
+             "target": mnt["target"],
+             "period": mnt["option"] if not mnt["readOnly"] else None}
+            for mnt in mounts if mnt["profile"] == "volume"]
+
+def getContainerMounts(aliDock, withCache):
+    """Docker mounts of a new container of aliDock: its shared directory, the native volume needed
+       on non-Linux, CVMFS, the build cache if withCache, and the user-defined mounts."""
+    from docker.types import Mount
+    dockMounts = [Mount(aliDock.dirInside, os.path.expanduser(aliDock.conf["dirOutside"]),
+                        type="bind", consistency=aliDock.conf["homeMountProfile"])]
+    if platform.system() != "Linux":
+        dockMounts.append(Mount("/persist", "persist-"+aliDock.conf["dockName"], type="volume"))
+
+    if aliDock.conf["cvmfs"]:
+        dockMounts.append(Mount(source="/cvmfs",
+                                target="/cvmfs",
+                                type="bind",
+                                propagation="shared" if platform.system() == "Linux" else None))
+
+    if withCache:
+        # Shared by all the containers of the current user, and surviving them
+        dockMounts.append(Mount("/cache", "alidock-cache-{userId}".format(userId=getUserId()),
+                                type="volume"))
+
+    return dockMounts + getDockerMounts(parseMounts(aliDock.conf["mount"]))  # user-defined mounts
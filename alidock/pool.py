@@ -0,0 +1,125 @@
+"""Warm pool of paused containers, started ahead of time with the configuration of an alidock
+container: `alidock enter` and `alidock start` claim one of them instead of creating a container
+from scratch. See `alidock warm`."""
+
+import errno
+import hashlib
+import os
+import os.path
+import posixpath
+import shutil
+from alidock.endpoint import waitSshPort
+from alidock.trace import TRACE
+from alidock.util import AliDockError, BackgroundCall
+
+class WarmPool(object):
+    """Warm pool of the given AliDock object: members are named after its container, and labelled
+       with the fingerprint of its configuration."""
+
+    def __init__(self, aliDock):
+        self.aliDock = aliDock
+
+    def list(self, paused=False):
+        """List the containers of the warm pool. If paused is True, only ready containers matching
+           the current configuration are returned."""
+        filters = {"label": "alidock.pool"}
+        if paused:
+            filters = {"label": "alidock.pool=" + self.aliDock.getFingerprint(), "status": "paused"}
+        return [cont for cont in self.aliDock.cli.containers.list(all=True, filters=filters)
+                if cont.name.startswith(self.aliDock.conf["dockName"] + "-pool-")]
+
+    @TRACE.traced("claimWarm")
+    def claim(self):
+        """Turn a paused container from the warm pool into the alidock container. Returns True on
+           success, False if no suitable container is available."""
+        import docker
+        for container in self.list(paused=True):
+            try:
+                # Renaming is atomic: if another alidock process claimed it first, we fail here
+                container.rename(self.aliDock.conf["dockName"])
+            except docker.errors.APIError:
+                continue
+            container.unpause()
+            container.reload()
+            self.aliDock.invalidateContainerState(container)
+            sshDir = os.path.join(self.aliDock.getRunDir(), "ssh")  # for the SSH control socket
+            try:
+                os.makedirs(sshDir)
+            except OSError as exc:
+                if not os.path.isdir(sshDir):
+                    raise AliDockError("cannot create SSH directory: {msg}".format(msg=exc))
+            self.aliDock.endpoint.clear()
+            self.aliDock.endpoint.save(container.attrs)
+            return True
+        return False
+
+    def add(self):
+        """Start a new container for the warm pool, and pause it as soon as it is ready."""
+        poolId = hashlib.sha1(os.urandom(16)).hexdigest()[:8]
+        container = self.aliDock.run(poolId=poolId)
+        sshPort = container.attrs["NetworkSettings"]["Ports"]["22/tcp"][0]["HostPort"]
+        readyFile = os.path.join(self.aliDock.getRunDir(), "pool", poolId, "ready")
+        if not waitSshPort(readyFile, sshPort, self.aliDock.conf["startTimeout"]):
+            container.remove(force=True)
+            raise AliDockError("warm container {name} did not start up in time"
+                               .format(name=container.name))
+        container.pause()
+
+    def removeStaleRunDirs(self):
+        """Remove the run directories of pool containers which do not exist anymore."""
+        poolDir = os.path.join(self.aliDock.getRunDir(), "pool")
+        if not os.path.isdir(poolDir):
+            return
+        inUse = [cont.labels.get("alidock.runDir") for cont in
+                 self.aliDock.cli.containers.list(all=True, filters={"label": "alidock.runDir"})]
+        for poolId in os.listdir(poolDir):
+            if posixpath.join("pool", poolId) not in inUse:
+                shutil.rmtree(os.path.join(poolDir, poolId), ignore_errors=True)
+
+    def fill(self):
+        """Make sure there are warmPool paused containers ready to be claimed. Containers created
+           with a different configuration are removed. Returns the number of containers added."""
+        import docker
+        poolSize = int(self.aliDock.conf["warmPool"])
+        fingerprint = self.aliDock.getFingerprint()
+        pool = []
+        for container in self.list():
+            if container.labels.get("alidock.pool") != fingerprint or len(pool) >= poolSize:
+                container.remove(force=True)  # stale or exceeding
+            else:
+                pool.append(container)
+        self.removeStaleRunDirs()
+
+        # Start missing containers in parallel
+        adding = [BackgroundCall(self.add) for _ in range(poolSize - len(pool))]
+        for add in adding:
+            try:
+                add.result()
+            except (AliDockError, docker.errors.APIError) as exc:
+                raise AliDockError("cannot add container to the warm pool: {msg}".format(msg=exc))
+        return len(adding)
+
+def getContainerRunDir(aliDock, state):
+    """Run directory on the host of the container of aliDock described by state: containers claimed
+       from the warm pool keep using their own one."""
+    poolRunDir = state.labels.get("alidock.runDir")
+    if poolRunDir:
+        return os.path.join(aliDock.getRunDir(), *poolRunDir.split("/"))
+    return aliDock.getRunDir()
+
+def makeRunDir(aliDock, poolId=None):
+    """Create the directory shared with a new container of aliDock: its run directory, or its own
+       subdirectory for warm pool members. Returns its path on the host and inside the
+       container."""
+    runDir = aliDock.getRunDir()
+    runDirInside = aliDock.getRunDirInside()
+    if poolId:
+        runDir = os.path.join(runDir, "pool", poolId)
+        runDirInside = posixpath.join(runDirInside, "pool", poolId)
+    try:
+        os.makedirs(runDir)
+    except OSError as exc:
+        if not os.path.isdir(runDir) or exc.errno != errno.EEXIST:
+            raise AliDockError("cannot create directory {dir} to share with container, "
+                               "check permissions".format(dir=aliDock.conf["dirOutside"]))
+    return runDir, runDirInside
@@ -0,0 +1,200 @@
+"""Cache of the digests of the images in their registries, shared by all the alidock instances and
+users of the host. Entries are revalidated with conditional HEAD requests for the manifest, which
+do not count towards the pull rate limits of Docker Hub and do not involve the Docker daemon.
+
+Entries are only hints used to decide whether to pull an image (by tag): any user of the host can
+write them. Users cannot replace each other's entries, and the authentication parameters of the
+registries are never read from the cache."""
+
+import errno
+import glob
+import hashlib
+import json
+import os
+import os.path
+import re
+import stat
+import tempfile
+from time import time
+from alidock.util import AliDockError, getUserId
+
+DEFAULT_REGISTRY = "registry-1.docker.io"
+CACHE_TTL = 300  # entries younger than this are used without contacting the registry
+MANIFEST_TYPES = ["application/vnd.docker.distribution.manifest.list.v2+json",
+                  "application/vnd.oci.image.index.v1+json",
+                  "application/vnd.docker.distribution.manifest.v2+json",
+                  "application/vnd.oci.image.manifest.v1+json"]
+
+class RegistryError(AliDockError):
+    """Error querying the registry, or an image reference it cannot be queried for."""
+
+def parseReference(imageName):
+    """Split imageName into registry, repository and tag, normalised like Docker does: for instance
+       "alisw/alidock" is ("registry-1.docker.io", "alisw/alidock", "latest"). Raises RegistryError
+       for references pinned to a digest."""
+    if "@" in imageName:
+        raise RegistryError("{image} is pinned to a digest".format(image=imageName))
+    name, tag = imageName, "latest"
+    head, sep, tail = imageName.rpartition(":")
+    if sep and "/" not in tail:
+        name, tag = head, tail
+    first, sep, rest = name.partition("/")
+    if sep and ("." in first or ":" in first or first == "localhost"):
+        registry, repo = first, rest
+    else:
+        registry, repo = DEFAULT_REGISTRY, name
+    if registry in ["docker.io", "index.docker.io"]:
+        registry = DEFAULT_REGISTRY
+    if registry == DEFAULT_REGISTRY and "/" not in repo:
+        repo = "library/" + repo
+    return registry, repo, tag
+
+class DigestCache(object):
+    """Digests of the images in their registries, as JSON files in cacheDir (by default a directory
+       with the sticky bit set in the temporary directory, writable by all users). Each user writes
+       their own file for each image reference: the freshest entry written by any user is used."""
+
+    def __init__(self, cacheDir=None, ttl=CACHE_TTL, timeout=10):
+        self.cacheDir = cacheDir or os.path.join(tempfile.gettempdir(), "alidock-registry-cache")
+        self.ttl = ttl
+        self.timeout = timeout
+
+    @staticmethod
+    def entryKey(registry, repo, tag):
+        ref = "{registry}/{repo}:{tag}".format(registry=registry, repo=repo, tag=tag)
+        return hashlib.sha256(ref.encode("utf-8")).hexdigest()
+
+    def isUsable(self):
+        """Check whether the cache directory can be trusted not to have its entries replaced by
+           other users: it must have the sticky bit set if it is writable by all users. A missing
+           directory is created."""
+        try:
+            os.makedirs(self.cacheDir)
+            os.chmod(self.cacheDir, 0o1777)  # shared by all users, regardless of the umask
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                return False
+        try:
+            info = os.lstat(self.cacheDir)
+            if not stat.S_ISDIR(info.st_mode):
+                return False
+            if hasattr(os, "getuid") and \
+               info.st_mode & (stat.S_IWOTH | stat.S_ISVTX) == stat.S_IWOTH:
+                if info.st_uid != os.getuid():
+                    return False
+                os.chmod(self.cacheDir, 0o1777)
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def load(path):
+        """Load the entry at path. Entries which cannot be read, or whose fields do not have the
+           expected types, are ignored: an empty dict is returned."""
+        try:
+            with open(path) as fil:
+                entry = json.load(fil)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(entry, dict) or \
+           not isinstance(entry.get("digest"), str) or \
+           not isinstance(entry.get("etag"), (str, type(None))) or \
+           not isinstance(entry.get("checked"), (int, float)) or \
+           isinstance(entry.get("checked"), bool):
+            return {}
+        return entry
+
+    def loadFreshest(self, key):
+        """Return the most recently checked valid entry written by any user for the given key, or
+           an empty dict."""
+        paths = glob.glob(os.path.join(self.cacheDir, key + "-*.json"))
+        entries = [self.load(path) for path in paths]
+        entries = [entry for entry in entries if entry and entry["checked"] <= time()]
+        return max(entries, key=lambda entry: entry["checked"]) if entries else {}
+
+    def save(self, key, entry):
+        """Atomically replace the entry of the current user for key. Errors are ignored: the cache
+           is optional."""
+        path = os.path.join(self.cacheDir, "{key}-{userId}.json".format(key=key,
+                                                                      userId=getUserId()))
+        try:
+            fd, tmpPath = tempfile.mkstemp(dir=self.cacheDir, prefix=".tmp-")
+            with os.fdopen(fd, "w") as fil:
+                json.dump(entry, fil)
+            os.chmod(tmpPath, 0o644)
+            os.replace(tmpPath, path)
+        except (IOError, OSError):
+            pass
+
+    def store(self, imageName, digest, etag=None):
+        """Record digest as the current digest of imageName in its registry."""
+        registry, repo, tag = parseReference(imageName)
+        if self.isUsable():
+            self.save(self.entryKey(registry, repo, tag),
+                      {"image": "{registry}/{repo}:{tag}".format(registry=registry, repo=repo,
+                                                                 tag=tag),
+                       "digest": digest, "etag": etag, "checked": int(time())})
+
+    def getDigest(self, imageName):
+        """Return the digest of imageName in its registry. Fresh entries are returned as they are,
+           stale ones are revalidated with a conditional request. Raises RegistryError if the
+           registry cannot be queried directly (e.g. it requires credentials)."""
+        registry, repo, tag = parseReference(imageName)
+        entry = self.loadFreshest(self.entryKey(registry, repo, tag)) if self.isUsable() else {}
+        if entry and time() - entry["checked"] < self.ttl:
+            return entry["digest"]
+        digest, etag = self.headManifest(registry, repo, tag, entry.get("etag"))
+        digest = digest or entry["digest"]  # not modified
+        self.store(imageName, digest, etag)
+        return digest
+
+    def headManifest(self, registry, repo, tag, etag):
+        """Perform a HEAD request for the manifest, conditional if etag is given. If the registry
+           requires token authentication, an anonymous pull token is requested from the service
+           indicated by the initial unauthorised response: the authentication parameters are not
+           cached, as other users can write the cache. Returns the digest (None if not modified and
+           not reported by the registry) and the ETag."""
+        import requests
+        host = registry.split(":")[0]
+        scheme = "http" if host == "localhost" or host.startswith("127.") else "https"
+        url = "{scheme}://{registry}/v2/{repo}/manifests/{tag}".format(
+            scheme=scheme, registry=registry, repo=repo, tag=tag)
+        headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+        if etag:
+            headers["If-None-Match"] = etag
+        try:
+            resp = requests.head(url, headers=headers, timeout=self.timeout)
+            if resp.status_code == 401:
+                auth = dict(re.findall(r'(\w+)="([^"]*)"',
+                                       resp.headers.get("WWW-Authenticate", "")))
+                headers["Authorization"] = "Bearer " + self.getToken(auth, repo)
+                resp = requests.head(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as exc:
+            raise RegistryError("cannot query {url}: {msg}".format(url=url, msg=exc))
+        if resp.status_code == 304 and etag:
+            return resp.headers.get("Docker-Content-Digest"), etag
+        digest = resp.headers.get("Docker-Content-Digest")
+        if resp.status_code != 200 or not digest:
+            raise RegistryError("cannot get the digest from {url}: HTTP status {code}".format(
+                url=url, code=resp.status_code))
+        return digest, resp.headers.get("ETag", '"{digest}"'.format(digest=digest))
+
+    def getToken(self, auth, repo):
+        """Get an anonymous pull token for repo from the authentication service in auth."""
+        import requests
+        if not auth.get("realm"):
+            raise RegistryError("unsupported registry authentication")
+        resp = requests.get(auth["realm"], timeout=self.timeout,
+                            params={"service": auth.get("service", ""),
+                                    "scope": "repository:{repo}:pull".format(repo=repo)})
+        try:
+            token = resp.json() if resp.status_code == 200 else {}
+        except ValueError:
+            token = {}
+        if not isinstance(token, dict):
+            token = {}
+        token = token.get("token") or token.get("access_token")
+        if not isinstance(token, str) or not token:
+            raise RegistryError("cannot get a pull token from {realm}: HTTP status {code}".format(
+                realm=auth["realm"], code=resp.status_code))
+        return token
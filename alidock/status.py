@@ -0,0 +1,78 @@
+"""Status of the alidock container, as reported by `alidock status --json`: it is described with
+two Docker API requests (three with the resource usage), without loading the Docker SDK."""
+
+import calendar
+from time import time, strptime
+from alidock.freeze import Freezer
+from alidock.trace import TRACE
+from alidock.updates import UpdateChecker, getRepoDigest
+from alidock.util import AliDockError, getVersion
+
+def getUpdatesStatus(aliDock):
+    """Describe the state of the update checks, read from their state files: no check is
+       performed."""
+    checker = UpdateChecker(aliDock)
+    clientChecked, clientPending = checker.getState(".alidock_pip_check")
+    imageChecked, imagePending = checker.getState(".alidock_docker_check")
+    return {"alidock": {"lastCheck": clientChecked or None,
+                        "pending": clientPending is not None and clientPending == getVersion()},
+            "image": {"lastCheck": imageChecked or None,
+                      "pending": imagePending == aliDock.conf["imageName"]}}
+
+def getUptime(startedAt):
+    """Seconds elapsed since the time startedAt, as reported by Docker, or None if invalid."""
+    try:
+        started = calendar.timegm(strptime(startedAt[:19], "%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        return None
+    return max(0, int(time()) - started)
+
+def getStats(stats):
+    """Describe the resource usage of the container, from the statistics reported by Docker."""
+    memStats = stats.get("memory_stats") or {}
+    return {"memoryBytes": memStats.get("usage"),
+            "memoryLimitBytes": memStats.get("limit"),
+            "cpuSeconds": ((stats.get("cpu_stats") or {}).get("cpu_usage") or {})
+                          .get("total_usage", 0) / 1e9,
+            "pids": (stats.get("pids_stats") or {}).get("current")}
+
+@TRACE.traced("getStatus")
+def getStatus(aliDock, withStats=False):
+    """Describe the container of aliDock as a dict. The state of update checks is read from their
+       state files: no check is performed."""
+    from alidock.dockerapi import DockerApiError
+    try:
+        attrs = aliDock.api.inspectContainer(aliDock.conf["dockName"])
+        imageAttrs = aliDock.api.inspectImage(attrs["Image"]) if attrs else None
+        stats = aliDock.api.stats(attrs["Id"]) if attrs and withStats else None
+    except DockerApiError as exc:
+        raise AliDockError(str(exc))
+
+    status = {"name": aliDock.conf["dockName"].rsplit("-", 1)[0],
+              "container": aliDock.conf["dockName"],
+              "running": False, "state": None, "id": None, "image": None, "imageId": None,
+              "digest": None, "ports": {}, "startedAt": None, "uptime": None, "stats": None,
+              "frozen": None, "updates": getUpdatesStatus(aliDock)}
+    if not attrs:
+        return status
+
+    state = attrs.get("State") or {}
+    if state.get("Status") == "paused":
+        status["frozen"] = Freezer(aliDock).getFrozenInfo()
+    status.update({"running": bool(state.get("Running")),
+                   "state": state.get("Status"),
+                   "id": attrs["Id"],
+                   "image": (attrs.get("Config") or {}).get("Image"),
+                   "imageId": attrs.get("Image")})
+    if imageAttrs:
+        status["digest"] = getRepoDigest(status["image"], imageAttrs)
+    for port, bindings in ((attrs.get("NetworkSettings") or {}).get("Ports") or {}).items():
+        if bindings:
+            status["ports"][port] = "{host}:{port}".format(host=bindings[0]["HostIp"],
+                                                          port=bindings[0]["HostPort"])
+    if status["running"] and state.get("StartedAt"):
+        status["startedAt"] = state["StartedAt"]
+        status["uptime"] = getUptime(state["StartedAt"])
+    if stats:
+        status["stats"] = getStats(stats)
+    return status
@@ -0,0 +1,100 @@
+import json
+import os.path
+from contextlib import contextmanager
+from functools import wraps
+from io import open
+from time import time
+
+class Trace(object):
+    """Collect timing spans of the various phases of an alidock invocation. Spans can be reported
+       as debug messages as they end, and saved to a file to be merged in a report later on."""
+
+    def __init__(self):
+        self.spans = []
+        self.log = None
+
+    def setLog(self, log):
+        """Report each span as a debug message to the given Log object (None to disable)."""
+        self.log = log
+
+    @contextmanager
+    def span(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            end = time()
+            self.spans.append({"name": name, "start": start, "end": end})
+            if self.log:
+                self.log.debug("[trace] {name}: {ms:.1f} ms".format(name=name,
+                                                                   ms=(end-start)*1000.))
+
+    def traced(self, name):
+        """Decorator recording a span for each call of the decorated function."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def save(self, fileName):
+        try:
+            with open(fileName, "w") as fil:
+                fil.write(json.dumps({"spans": self.spans}))
+        except (IOError, OSError):
+            pass  # tracing is never fatal
+
+TRACE = Trace()  # spans of the current alidock invocation, recorded by all the alidock modules
+
+def loadHostSpans(fileName):
+    """Load spans saved by Trace.save. Returns an empty list if there are none."""
+    try:
+        with open(fileName) as fil:
+            return [dict(span, source="host") for span in json.loads(fil.read())["spans"]]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return []
+
+def loadInitSpans(fileName):
+    """Load the step timings written by the container's init script, one "<step> <start> <end>"
+       per line, in the order in which steps complete (steps run concurrently). Lines without an end
+       come from older init scripts, whose phases last until the next one begins."""
+    marks = []
+    try:
+        with open(fileName) as fil:
+            for line in fil:
+                try:
+                    fields = line.split()
+                    marks.append((fields[0],) + tuple(float(stamp) for stamp in fields[1:3]))
+                except (ValueError, IndexError):
+                    continue
+    except (IOError, OSError):
+        return []
+    spans = []
+    for i, mark in enumerate(marks):
+        if len(mark) == 3:
+            end = mark[2]
+        else:
+            end = marks[i+1][1] if i+1 < len(marks) else mark[1]
+        spans.append({"name": mark[0], "start": mark[1], "end": end, "source": "init"})
+    return spans
+
+def saveHostSpans(runDir):
+    """Save the spans of the current invocation to the run directory, for `alidock profile`."""
+    TRACE.save(os.path.join(runDir, "profile-host.json"))
+
+def loadProfile(runDir):
+    """Merge the spans of the last invocation with the ones of the init script, from the given run
+       directory. Returns a dict with the origin timestamp and the spans sorted by start time, with
+       their offset and duration in milliseconds, or None if there are no spans."""
+    spans = loadHostSpans(os.path.join(runDir, "profile-host.json")) + \
+            loadInitSpans(os.path.join(runDir, "profile-init.txt"))
+    if not spans:
+        return None
+    origin = min(span["start"] for span in spans)
+    for span in spans:
+        span["offsetMs"] = round((span["start"] - origin) * 1000., 1)
+        span["durationMs"] = round((span["end"] - span["start"]) * 1000., 1)
+    spans.sort(key=lambda span: span["start"])
+    return {"origin": origin, "spans": spans}
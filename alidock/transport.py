@@ -0,0 +1,18 @@
+"""Docker exec transport, an alternative to SSH selected with the transport option: commands run in
+the container through the Docker exec API, and only need its init script to have created the
+user."""
+
+import os
+
+def getDockerExecCommand(aliDock, cmd, tty):
+    """Return the command line running cmd (a list of arguments, joined like SSH would do) in a
+       login shell in the container of aliDock through the Docker exec API, using the docker
+       client. An interactive login shell is started if cmd is empty."""
+    dockerCmd = ["docker", "exec", "-i", "-u", aliDock.userName, "-w", aliDock.dirInside]
+    if tty:
+        dockerCmd.append("-t")
+    for var in ["TERM", "LANG", "LANGUAGE", "LC_ALL", "LC_CTYPE", "LC_MESSAGES"]:
+        if var in os.environ:
+            dockerCmd += ["-e", var]  # forwarded from our environment, like SSH does
+    return dockerCmd + [aliDock.conf["dockName"], "bash", "-l"] + \
+           (["-c", " ".join(cmd)] if cmd else [])
@@ -0,0 +1,399 @@
+"""Updates of alidock and of the container image: periodic checks, run in the background and whose
+result is applied when actually needed, image pulls with progress, and `alidock prefetch`."""
+
+import errno
+import json
+import os
+import os.path
+import platform
+import sys
+from datetime import datetime as dt
+from time import time
+from alidock.log import LOG
+from alidock.trace import TRACE
+from alidock.util import AliDockError, deactivateVenv, getVersion, spawnDetached
+
+INSTALLER_URL = "https://raw.githubusercontent.com/alidock/alidock/master/alidock-installer.sh"
+UPDATE_CHECK_GRACE = 2  # seconds to wait for background update checks when their result is needed
+PULL_MARKER_TTL = 3600  # seconds after which a background pull is considered dead
+PREFETCH_NICENESS = 10  # scheduling priority decrease of `alidock prefetch`
+
+def getRepoDigest(imageName, imageAttrs):
+    """Registry digest of the local image imageName with the given attributes, preferring the one
+       of its repository, or None if it was not pulled from a registry (e.g. built locally, or
+       baked)."""
+    digests = imageAttrs.get("RepoDigests") or []
+    repo = (imageName or "").rsplit(":", 1)[0]
+    matching = [dig for dig in digests if dig.split("@")[0] == repo]
+    digest = (matching or digests or [None])[0]
+    return digest.split("@")[-1] if digest else None
+
+class UpdateChecker(object):
+    """Checks for updates of alidock and of the image of the given AliDock object. The state of the
+       checks is saved in its shared directory."""
+
+    def __init__(self, aliDock):
+        self.aliDock = aliDock
+        self.stateDir = os.path.expanduser(aliDock.conf["dirOutside"])
+
+    def getState(self, stateFileRelative):
+        """Read the update check state file stateFileRelative. Returns a tuple with the timestamp of
+           the last check and the tag of the update found and not applied yet (None if there is
+           no pending update). It does not perform any network operation."""
+        try:
+            with open(os.path.join(self.stateDir, stateFileRelative)) as fil:
+                state = fil.read().split(None, 1)
+            return int(state[0]), (state[1].strip() if len(state) > 1 else None)
+        except (IOError, OSError, ValueError, IndexError):
+            return 0, None
+
+    def setState(self, stateFileRelative, lastUpdate, pendingTag=None):
+        """Save the update check state file stateFileRelative. See getState."""
+        try:
+            os.makedirs(self.stateDir)
+        except OSError as exc:
+            if not os.path.isdir(self.stateDir) or exc.errno != errno.EEXIST:
+                raise exc
+        state = str(lastUpdate) + (" " + pendingTag if pendingTag else "")
+        with open(os.path.join(self.stateDir, stateFileRelative), "w") as fil:
+            try:
+                fil.write(state)
+            except TypeError:
+                fil.write(state.decode("utf-8"))
+
+    def isDue(self, stateFileRelative, updatePeriod):
+        """Cheap check telling whether the last update check, saved in stateFileRelative, is older
+           than updatePeriod seconds. It does not perform any network operation."""
+        return int(time()) - self.getState(stateFileRelative)[0] > int(updatePeriod)
+
+    def hasUpdates(self, stateFileRelative, updatePeriod, pendingTag, updateFunc, force=False):
+        """Generic function that checks for updates every updatePeriod seconds, saving the state
+           on stateFileRelative (relative to the container's home directory). It returns True in
+           case there is an update, False in case there is none. A custom function updateFunc is
+           ran to determine whether to update. When an update is found it is recorded in the state
+           file along with pendingTag: subsequent calls report it without checking again, until it
+           is cleared with setState or a different pendingTag is used (for instance, the currently
+           installed version). This nags users until they update.
+
+           The time of the check is recorded before performing it: checks run in the background
+           can be interrupted when the process is replaced by the shell, and they are not attempted
+           again (nor waited for) before updatePeriod has elapsed. Such checks are handed over to a
+           detached process, which uses force to check regardless of the recorded time."""
+
+        lastUpdate, pending = self.getState(stateFileRelative)
+        if pending is not None and pending == pendingTag:
+            return True
+
+        now = int(time())
+        updateAvail = False
+        if force or now - lastUpdate > int(updatePeriod):
+            self.setState(stateFileRelative, now)
+            updateAvail = updateFunc()
+            if updateAvail:
+                self.setState(stateFileRelative, now, pendingTag)
+
+        return updateAvail
+
+    @TRACE.traced("hasClientUpdates")
+    def hasClientUpdates(self, force=False):
+        """Check for client updates (alidock) without performing them. Returns True if updates are
+           found, false otherwise. With force, check even if the last check is recent."""
+
+        updatePeriod = self.aliDock.conf["updatePeriod"]
+        if not force and self.getState(".alidock_pip_check")[1] is None and \
+           not self.isDue(".alidock_pip_check", updatePeriod):
+            # Checked recently: avoid loading the (slow) packaging and HTTP machinery altogether
+            return False
+
+        if getVersion() == "LAST-TAG":
+            # No check for local development or version from VCS
+            return False
+
+        def updateFunc():
+            import requests
+            from requests.exceptions import RequestException
+            from pkg_resources import parse_version
+            try:
+                pyr = requests.get("https://pypi.org/pypi/{pkg}/json".format(pkg=__package__),
+                                   timeout=5)
+                pyr.raise_for_status()
+                pypiData = pyr.json()
+                availVersion = parse_version(pypiData["info"]["version"])
+                localVersion = parse_version(getVersion())
+                uploadTimeUTC = pypiData["releases"][str(availVersion)][0]["upload_time"]
+                uploadTimeUTC = dt.strptime(uploadTimeUTC, "%Y-%m-%dT%H:%M:%S")
+                updateAge = (dt.utcnow() - uploadTimeUTC).total_seconds()
+                if availVersion > localVersion and updateAge > 900:
+                    # Update is at least 15 min old to allow all PyPI caches to sync
+                    return True
+            except (RequestException, ValueError) as exc:
+                raise AliDockError(str(exc))
+            return False
+
+        # Pending update is tagged with the current version: it is forgotten when alidock is updated
+        return self.hasUpdates(stateFileRelative=".alidock_pip_check",
+                               updatePeriod=updatePeriod,
+                               pendingTag=getVersion(),
+                               updateFunc=updateFunc,
+                               force=force)
+
+    def inspectLocalImage(self, imageName):
+        """Return the attributes of the local image imageName, or None if it does not exist
+           locally. Raises AliDockError on failure."""
+        from alidock.dockerapi import DockerApiError
+        try:
+            return self.aliDock.api.inspectImage(imageName)
+        except DockerApiError as exc:
+            raise AliDockError("cannot inspect {image}: {msg}".format(image=imageName, msg=exc))
+
+    def getLocalDigest(self, imageName):
+        """Return the registry digest of the local image imageName, or None if it does not exist
+           locally. Raises AliDockError if the digest cannot be determined."""
+        image = self.inspectLocalImage(imageName)
+        if image is None:
+            return None
+        localHash = getRepoDigest(imageName, image)
+        if localHash is None:
+            raise AliDockError("cannot get the digest of {image}: it does not come from a "
+                               "registry".format(image=imageName))
+        return localHash
+
+    def getRegistryDigest(self, imageName):
+        """Return the digest of imageName in the registry. The digest cache shared by the users of
+           the host is used when possible, the Docker daemon otherwise (e.g. when credentials are
+           needed). Raises AliDockError on failure."""
+        from alidock.registry import DigestCache, RegistryError
+        try:
+            return DigestCache().getDigest(imageName)
+        except RegistryError as exc:
+            if self.aliDock.conf["debug"]:
+                LOG.debug("Checking {image} through Docker: {msg}".format(image=imageName, msg=exc))
+        import docker
+        try:
+            registryData = self.aliDock.cli.images.get_registry_data(imageName)
+            return registryData.attrs["Descriptor"]["digest"]
+        except docker.errors.APIError as exc:
+            raise AliDockError(str(exc))
+
+    @TRACE.traced("hasImageUpdates")
+    def hasImageUpdates(self, force=False):
+        """Check for image updates without performing them. Returns True if updates are found, False
+           otherwise. With force, check even if the last check is recent."""
+
+        imageName = self.aliDock.conf["imageName"]
+        if self.aliDock.conf["dontUpdateImage"]:
+            return False
+
+        def updateFunc():
+            localHash = self.getLocalDigest(imageName)
+            if localHash is None:
+                # Image does not exist locally: no updates are available (run will fetch it)
+                return False
+            return self.getRegistryDigest(imageName) != localHash
+
+        # Pending update is cleared by AliDock.pull()
+        return self.hasUpdates(stateFileRelative=".alidock_docker_check",
+                               updatePeriod=self.aliDock.conf["updatePeriod"],
+                               pendingTag=imageName,
+                               updateFunc=updateFunc,
+                               force=force)
+
+def doAutoUpdate():
+    """Perform an automatic update of alidock only if it was installed in the custom virtual
+       environment."""
+    curModulePath = os.path.realpath(__file__)
+    virtualenvPath = os.path.realpath(os.path.expanduser("~/.virtualenvs/alidock"))
+    if curModulePath.startswith(virtualenvPath):
+        LOG.warning("Updating alidock automatically")
+        updateEnv = os.environ
+        deactivateVenv(updateEnv)
+        updateEnv["ALIDOCK_ARGS"] = " ".join(sys.argv[1:])
+        updateEnv["ALIDOCK_RUN"] = "1"
+        os.execvpe("bash",
+                   ["bash", "-c",
+                    "bash <(curl -fsSL {u}) --no-check-docker --quiet".format(u=INSTALLER_URL)],
+                   updateEnv)
+
+def formatPullProgress(layers, elapsed):
+    done = sum(1 for layer in layers.values()
+               if layer["status"] in ["Pull complete", "Already exists"])
+    current = sum(layer["current"] for layer in layers.values())
+    total = sum(layer["total"] for layer in layers.values())
+    return "Pulling image: {done}/{num} layers, {cur:.0f}/{tot:.0f} MB downloaded, " \
+           "{rate:.1f} MB/s".format(done=done, num=len(layers), cur=current / 1e6,
+                                    tot=total / 1e6, rate=current / 1e6 / max(elapsed, 1e-3))
+
+def streamPull(aliDock, progress, imageName):
+    """Pull imageName through the low-level API, which streams the status of each layer."""
+    from docker.utils import parse_repository_tag
+    repo, tag = parse_repository_tag(imageName)
+    layers = {}
+    start = time()
+    lastReport = 0
+    interval = 0.5 if sys.stderr.isatty() else 10
+    for event in aliDock.cli.api.pull(repo, tag or "latest", stream=True, decode=True):
+        if "error" in event:
+            raise AliDockError(event["error"])
+        layerId = event.get("id")
+        if not layerId or event.get("status", "").startswith("Pulling from"):
+            continue
+        layer = layers.setdefault(layerId, {"status": None, "current": 0, "total": 0})
+        detail = event.get("progressDetail") or {}
+        if aliDock.conf["debug"] and event.get("status") != layer["status"]:
+            LOG.debug("{layer}: {status}".format(layer=layerId, status=event.get("status")))
+        layer["status"] = event.get("status")
+        if layer["status"] == "Downloading" and detail.get("total"):
+            layer["current"], layer["total"] = detail.get("current", 0), detail["total"]
+        elif layer["status"] == "Download complete":
+            layer["current"] = layer["total"]
+        if progress and time() - lastReport > interval:
+            lastReport = time()
+            LOG.progress(formatPullProgress(layers, time() - start))
+    if progress and layers:
+        LOG.progress(formatPullProgress(layers, time() - start), final=True)
+
+def getPullMarker(aliDock):
+    return os.path.join(os.path.expanduser(aliDock.conf["dirOutside"]), ".alidock_pull_running")
+
+def isPulling(aliDock):
+    """Whether an image pull is running in the background, according to its marker file."""
+    try:
+        return time() - os.path.getmtime(getPullMarker(aliDock)) < PULL_MARKER_TTL
+    except OSError:
+        return False
+
+def setPulling(aliDock, pulling):
+    try:
+        if pulling:
+            with open(getPullMarker(aliDock), "w") as fil:
+                fil.write(str(os.getpid()))
+        else:
+            os.unlink(getPullMarker(aliDock))
+    except (IOError, OSError):
+        pass
+
+def processClientUpdates(aliDock, clientCheck):
+    """Apply the result of the alidock update check running in the background. If it is not ready
+       in time it is not waited for: a detached process, which survives this one being replaced by
+       the shell, checks again and saves its outcome for the next run."""
+    if clientCheck is None:
+        return
+    try:
+        hasUpdates = clientCheck.result(timeout=UPDATE_CHECK_GRACE)
+    except TimeoutError:
+        spawnDetached("checkClientUpdatesDetached", aliDock.exportConf())
+        return
+    except Exception as exc:  # pylint: disable=broad-except
+        # Not only AliDockError: errors of the libraries used by the check are raised as they are
+        LOG.warning("Cannot check for alidock updates this time: {msg}".format(msg=exc))
+        return
+
+    if hasUpdates and platform.system() == "Windows":
+        # No auto update on Windows at the moment
+        LOG.error("You are using an obsolete version of alidock. Use pip to upgrade it.")
+    elif hasUpdates and not aliDock.conf["dontUpdateAlidock"]:
+        doAutoUpdate()
+        LOG.error("You are using an obsolete version of alidock.")
+        LOG.error("Upgrade NOW with:")
+        LOG.error("    bash <(curl -fsSL {url})".format(url=INSTALLER_URL))
+
+def processImageUpdates(aliDock, imageCheck):
+    """Pull the image if the update check running in the background found an update. With
+       backgroundPull, the image is pulled by a detached process while the current one is used. A
+       check not ready in time is handed over to a detached process, like in
+       processClientUpdates."""
+    try:
+        if not imageCheck.result(timeout=UPDATE_CHECK_GRACE):
+            return
+    except TimeoutError:
+        LOG.warning("Image update check is taking too long, using the current image this time")
+        spawnDetached("checkImageUpdatesDetached", aliDock.exportConf())
+        return
+    except Exception as exc:  # pylint: disable=broad-except
+        # Not only AliDockError: errors of the Docker SDK or of requests are raised as they are
+        LOG.warning("Cannot update container image this time: {msg}".format(msg=exc))
+        return
+
+    if aliDock.conf["backgroundPull"]:
+        if not isPulling(aliDock):
+            setPulling(aliDock, True)  # the detached process takes over the marker
+            spawnDetached("pullDetached", aliDock.exportConf())
+        LOG.warning("Container image update is being downloaded in the background: it will be "
+                    "used the next time the container is started")
+        return
+
+    LOG.info("Updating container image, hold on")
+    try:
+        aliDock.pull()
+    except AliDockError as exc:
+        LOG.warning("Cannot update container image this time: {msg}".format(msg=exc))
+        return
+    LOG.warning("Container updated, you may want to free some space with:")
+    LOG.warning("    docker system prune")
+
+def isSystemBusy(maxLoad):
+    """Whether the load per CPU is above maxLoad, where the load average is available."""
+    if not hasattr(os, "getloadavg"):
+        return False
+    load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    if load > float(maxLoad):
+        LOG.info("System is busy (load per CPU: {load:.2f}), not prefetching this time"
+                 .format(load=load))
+        return True
+    return False
+
+def prefetchImage(aliDock, image):
+    """Pull the update of image, if any. Returns the result saved in the prefetch results file."""
+    checker = UpdateChecker(aliDock)
+    now = int(time())
+    try:
+        imageAttrs = checker.inspectLocalImage(image)
+        localHash = getRepoDigest(image, imageAttrs) if imageAttrs else None
+        if imageAttrs and localHash is None:
+            # Built locally, or baked on top of the configured image (which is prefetched)
+            LOG.info("{image}: not from a registry, skipping".format(image=image))
+            return {"checked": now, "skipped": True}
+        availHash = checker.getRegistryDigest(image)
+        if localHash == availHash:
+            LOG.info("{image}: up to date".format(image=image))
+        else:
+            LOG.info("{image}: prefetching {digest}".format(image=image, digest=availHash))
+            aliDock.pull(progress=False, imageName=image)
+        if image == aliDock.conf["imageName"]:
+            checker.setState(".alidock_docker_check", now)
+        return {"checked": now, "digest": availHash, "pulled": localHash != availHash}
+    except AliDockError as exc:
+        LOG.error("{image}: cannot prefetch: {msg}".format(image=image, msg=exc))
+        return {"checked": now, "error": str(exc)}
+
+def processPrefetch(aliDock):
+    """Pull the updates of the configured image, and of the images of the running containers,
+       ahead of time: meant to be run periodically, e.g. from cron. The update check state is
+       saved, so that the next start uses the new image without checking nor pulling."""
+    if aliDock.conf["dontUpdateImage"]:
+        LOG.info("Image updates are disabled, nothing to prefetch")
+        return
+    if isSystemBusy(aliDock.conf["prefetchMaxLoad"]):
+        return
+    if hasattr(os, "nice"):
+        os.nice(PREFETCH_NICENESS)
+
+    images = [aliDock.conf["imageName"]]
+    for inst in aliDock.listInstances():
+        if inst["image"] and not inst["image"].startswith("sha256:") and \
+           inst["image"] not in images:
+            images.append(inst["image"])
+
+    # One image at a time, to limit the bandwidth used
+    results = {image: prefetchImage(aliDock, image) for image in images}
+    resultsFile = os.path.join(os.path.expanduser(aliDock.conf["dirOutside"]),
+                               ".alidock_prefetch.json")
+    try:
+        with open(resultsFile, "w") as fil:
+            fil.write(json.dumps(results, indent=2, sort_keys=True))
+    except (IOError, OSError):
+        pass
+    failed = sum(1 for res in results.values() if "error" in res)
+    if failed:
+        raise AliDockError("{failed} out of {num} image(s) could not be prefetched"
+                           .format(failed=failed, num=len(results)))
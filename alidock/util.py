@@ -1,13 +1,23 @@
+import json
 import os
 import os.path
+import posixpath
 import pwd
 import re
 import sys
 import platform
+import threading
+from time import time
 from pathlib import Path
-from subprocess import call
+from subprocess import call, Popen
 from hashlib import md5
 
+class AliDockError(Exception):
+    def __init__(self, msg):
+        super(AliDockError, self).__init__()
+        self.msg = msg
+    def __str__(self):
+        return self.msg
 
 def splitEsc(inp, delim, nDelim):
     """Splits input string inp with nDelim delimiters. Returns a tuple of nDelim+1 components: some
@@ -93,6 +103,62 @@ def getRocmVideoGid():
     except (KeyError, AttributeError, ModuleNotFoundError):  # pylint: disable=undefined-variable
         return None
 
+def parseSize(size):
+    """Convert a size like "20G" to bytes. Suffixes K, M, G and T are powers of 1024, no suffix
+    means bytes. Raises ValueError if the size is not valid."""
+    size = str(size).strip().upper().rstrip("B")
+    mult = 1
+    if size and size[-1] in "KMGT":
+        mult = 1024 ** ("KMGT".index(size[-1]) + 1)
+        size = size[:-1]
+    value = int(float(size) * mult)
+    if value <= 0:
+        raise ValueError("size must be positive")
+    return value
+
+class BackgroundCall(object):  # pylint: disable=too-few-public-methods
+    """Run func(*args) in a background daemon thread, in order to overlap it with other operations.
+    Daemon threads do not prevent the program from exiting (or from replacing itself with `exec`)
+    if the call is not needed anymore."""
+
+    def __init__(self, func, *args):
+        self.done = threading.Event()
+        self.value = None
+        self.exc = None
+        def runner():
+            try:
+                self.value = func(*args)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.exc = exc
+            self.done.set()
+        thr = threading.Thread(target=runner)
+        thr.daemon = True
+        thr.start()
+
+    def result(self, timeout=None):
+        """Wait at most timeout seconds (forever if None) for the call to complete and return its
+        result, or re-raise its exception. Raises TimeoutError if the call is still running."""
+        if not self.done.wait(timeout):
+            raise TimeoutError("background call still running")
+        if self.exc is not None:
+            raise self.exc  # pylint: disable=raising-bad-type
+        return self.value
+
+def parallelMap(func, items, maxWorkers):
+    """Call func(item) for each item using at most maxWorkers threads. Returns a list with, for each
+    item in the same order, a tuple (result, exception, seconds): exception is None on success."""
+    from concurrent.futures import ThreadPoolExecutor
+    def timed(item):
+        start = time()
+        try:
+            return func(item), None, time() - start
+        except Exception as exc:  # pylint: disable=broad-except
+            return None, exc, time() - start
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(items)))) as pool:
+        return list(pool.map(timed, items))
+
 if platform.system() == "Windows":
     def execReturn(_, args):
         """Executes the given program on Windows (no process substitution) and exits with the
@@ -105,3 +171,53 @@ else:
     def execReturn(progName, args):
         """Executes the given progName with the given args by replacing the current process."""
         os.execvp(progName, args)
+
+def spawnDetached(funcName, overrideConf):
+    """Call the function funcName of the alidock module from a detached process, which survives this
+    one being replaced by the shell. The command-line options are passed via the environment."""
+    env = os.environ.copy()
+    env["ALIDOCK_DETACHED_ARGS"] = json.dumps(overrideConf)
+    nul = open(os.devnull, "w")
+    kwargs = {"start_new_session": True} if platform.system() != "Windows" else {}
+    Popen([sys.executable, "-c", "from alidock import {func}; {func}()".format(func=funcName)],
+          stdin=nul, stdout=nul, stderr=nul, env=env, **kwargs)
+
+def readHelper(helperName):
+    """Return the contents of the helper file helperName as bytes. Helpers are read straight from
+    the package directory when possible, as importing pkg_resources is slow."""
+    try:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "helpers", helperName),
+                  "rb") as fil:
+            return fil.read()
+    except (IOError, OSError):
+        from pkg_resources import resource_string
+        return resource_string("alidock.helpers", helperName)
+
+def installHelper(aliDock, helperName):
+    """Copy the helper script helperName to the run directory of aliDock, and return its path inside
+    the container."""
+    helperPath = os.path.join(aliDock.getRunDir(), helperName)
+    try:
+        with open(helperPath, "wb") as fil:
+            fil.write(readHelper(helperName))
+    except (IOError, OSError) as exc:
+        raise AliDockError("cannot write {path}: {msg}".format(path=helperPath, msg=exc))
+    return posixpath.join(aliDock.getRunDirInside(), helperName)
+
+def getVersion():
+    """Return the installed alidock version as a string ("LAST-TAG" for development versions). The
+    pkg_resources module is slow to import: it is only used when importlib.metadata (Python 3.8+) is
+    not available."""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version(__package__)
+        except PackageNotFoundError:
+            return "LAST-TAG"  # running straight from a source checkout
+    except ImportError:
+        pass
+    from pkg_resources import require, DistributionNotFound
+    try:
+        return str(require(__package__)[0].version)
+    except DistributionNotFound:
+        return "LAST-TAG"
@@ -0,0 +1,44 @@
+#!/bin/bash -e
+
+# Compare the time to run a command in a new alidock container started from scratch (cold) or
+# claimed from the warm pool (warm). Needs Docker and the alidock image.
+
+set -o pipefail
+cd "$(dirname "$0")"/..
+
+function info() {
+  echo -e "\033[32;1m$1\033[m"
+}
+
+function alidock ()
+{
+    ( source "${HOME}/.virtualenvs/alidock/bin/activate" && command alidock "$@"; exit $? )
+}
+
+function elapsed_ms() {
+  local START END
+  START=$(date +%s%N)
+  "$@" > /dev/null
+  END=$(date +%s%N)
+  echo $(( (END - START) / 1000000 ))
+}
+
+DOCKER_IMAGE=${DOCKER_IMAGE:-alisw/alidock:latest}
+RUNS=${RUNS:-3}
+ARGS=(--quiet --no-update-image --image "$DOCKER_IMAGE" --warm-pool 1)
+
+COLD=0
+WARM=0
+for ((I=0; I<RUNS; I++)); do
+  alidock stop
+  COLD=$(( COLD + $(elapsed_ms alidock --quiet --no-update-image --image "$DOCKER_IMAGE" exec /bin/true) ))
+  alidock stop
+  alidock "${ARGS[@]}" warm
+  WARM=$(( WARM + $(elapsed_ms alidock "${ARGS[@]}" exec /bin/true) ))
+  alidock stop
+done
+
+alidock --quiet --warm-pool 0 warm  # remove containers left in the pool
+
+info "Cold enter: $(( COLD / RUNS )) ms on average over $RUNS runs"
+info "Warm enter: $(( WARM / RUNS )) ms on average over $RUNS runs"
@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+"""Offline benchmark of alidock against a fake Docker daemon.
+
+A small HTTP server on a Unix socket emulates the parts of the Docker Engine API used by alidock
+(containers, images, info, distribution), with a configurable latency per request. Containers
+"started" by the fake daemon create the readiness files expected from the init script and answer
+with an SSH banner on their forwarded port, while fake ssh and docker executables replace the real
+ones.
+
+Each scenario runs the alidock command line in a fresh interpreter and measures the number of
+Docker API round-trips, the wall time and the peak memory. The benchmark fails if the number of
+round-trips of any scenario exceeds its budget.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import os.path
+import re
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+from time import sleep, time
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    sys.exit("Python 3 is required")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from alidock.registry import DigestCache  # pylint: disable=wrong-import-position
+
+API_VERSION = "1.41"
+IMAGE_NAME = "alisw/alidock:latest"
+IMAGE_ID = "sha256:" + "a" * 64
+LOCAL_DIGEST = "sha256:" + "d" * 64
+
+class FakeDocker(ThreadingMixIn, UnixStreamServer):
+    """Fake Docker daemon listening on a Unix socket. It counts the requests it receives."""
+
+    daemon_threads = True
+
+    def __init__(self, sockPath, latency):
+        self.latency = latency
+        self.requests = []
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.registryDigest = LOCAL_DIGEST
+        self.images = {IMAGE_NAME: {"Id": IMAGE_ID, "RepoTags": [IMAGE_NAME],
+                                    "RepoDigests": ["alisw/alidock@" + LOCAL_DIGEST]}}
+        UnixStreamServer.__init__(self, sockPath, FakeDockerHandler)
+
+    def reset(self):
+        with self.lock:
+            self.requests = []
+
+    def findContainer(self, nameOrId):
+        for cont in self.containers.values():
+            if nameOrId in (cont["Id"], cont["Name"].lstrip("/")) or \
+               (len(nameOrId) >= 12 and cont["Id"].startswith(nameOrId)):
+                return cont
+        return None
+
+    def findImage(self, nameOrId):
+        for name, img in self.images.items():
+            if nameOrId in (name, img["Id"], img["Id"].split(":", 1)[1]):
+                return img
+        return None
+
+    def addContainer(self, name, body, running=True):
+        """Add a container as created by alidock. When running, readiness file and SSH banner are
+           provided as well."""
+        contId = os.urandom(32).hex()
+        img = self.findImage(body.get("Image", IMAGE_NAME))
+        cont = {"Id": contId, "Name": "/" + name, "Image": img["Id"] if img else IMAGE_ID,
+                "Created": "",
+                "Config": {"Image": body.get("Image", IMAGE_NAME), "Hostname": name,
+                           "Labels": body.get("Labels") or {}, "Cmd": body.get("Cmd"),
+                           "Tty": False},
+                "HostConfig": body.get("HostConfig", {}),
+                "State": {"Status": "created", "Running": False, "Paused": False,
+                          "StartedAt": "0001-01-01T00:00:00Z"},
+                "NetworkSettings": {"Ports": {}}}
+        self.containers[contId] = cont
+        if running:
+            self.startContainer(cont)
+        return cont
+
+    @staticmethod
+    def stopBanner(cont):
+        """Stop answering with an SSH banner on behalf of the container, if it did."""
+        if "banner" in cont:
+            cont.pop("banner").close()
+
+    @staticmethod
+    def startContainer(cont):
+        banner = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        banner.bind(("127.0.0.1", 0))
+        banner.listen(16)
+        def serveBanner():
+            while True:
+                try:
+                    conn = banner.accept()[0]
+                except OSError:
+                    return
+                conn.sendall(b"SSH-2.0-FakeDocker\r\n")
+                conn.close()
+        thr = threading.Thread(target=serveBanner)
+        thr.daemon = True
+        thr.start()
+        cont["banner"] = banner
+        cont["NetworkSettings"]["Ports"] = {
+            "22/tcp": [{"HostIp": "127.0.0.1", "HostPort": str(banner.getsockname()[1])}]}
+        cont["State"].update({"Status": "running", "Running": True,
+                              "StartedAt": "2020-01-01T00:00:00.000000000Z"})
+
+        # Emulate the init script: create the readiness file in the run directory
+        cmd = (cont["Config"].get("Cmd") or [""])[0]
+        for mnt in cont["HostConfig"].get("Mounts") or []:
+            target = mnt.get("Target", "").rstrip("/") + "/"
+            if mnt.get("Type") == "bind" and cmd.startswith(target):
+                runDir = os.path.dirname(os.path.join(mnt["Source"], cmd[len(target):]))
+                if os.path.isdir(runDir):
+                    for readyFile in ["ready-env", "ready"]:
+                        with open(os.path.join(runDir, readyFile), "w") as fil:
+                            fil.write("0\n")
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def reply(self, code, payload=None):
+        if isinstance(payload, tuple):
+            # Stream of JSON objects, one per chunk
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event in payload:
+                data = json.dumps(event).encode("utf-8") + b"\r\n"
+                self.wfile.write("{len:x}\r\n".format(len=len(data)).encode("utf-8") + data +
+                                 b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            return {}
+
+    def handle(self):
+        try:
+            BaseHTTPRequestHandler.handle(self)
+        except (ConnectionError, OSError):
+            pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.dispatch("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.dispatch("POST")
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        srv = self.server
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        query = parse_qs(url.query)
+        body = self.readBody()
+        with srv.lock:
+            srv.requests.append(method + " " + path)
+        sleep(srv.latency)
+        with srv.lock:
+            code, payload = self.route(method, path, query, body)
+        self.reply(code, payload)
+
+    def route(self, method, path, query, body):
+        if path in ["/version", "/_ping"]:
+            return 200, {"ApiVersion": API_VERSION, "Version": "20.10.0"}
+        if path == "/info":
+            return 200, {"Runtimes": {"runc": {"path": "runc"}}}
+        if path.startswith("/images/") or path.startswith("/distribution/"):
+            return self.routeImage(method, path)
+        if path in ["/containers/json", "/containers/create", "/commit"]:
+            return self.routeContainers(method, path, query, body)
+        return self.routeContainer(method, path, query)
+
+    def routeImage(self, method, path):
+        srv = self.server
+        match = re.match(r"^/images/(.+)/json$", path)
+        if match and method == "GET":
+            img = srv.findImage(match.group(1))
+            return (200, img) if img else notFound(path)
+        match = re.match(r"^/images/(.+)$", path)
+        if match and method == "DELETE":
+            img = srv.findImage(match.group(1))
+            if not img:
+                return notFound(path)
+            srv.images = {name: other for name, other in srv.images.items() if other is not img}
+            return 200, [{"Untagged": match.group(1)}]
+        match = re.match(r"^/distribution/(.+)/json$", path)
+        if match and method == "GET":
+            return 200, {"Descriptor": {"digest": srv.registryDigest,
+                                        "mediaType": "application/json", "size": 1},
+                         "Platforms": [{"architecture": "amd64", "os": "linux"}]}
+        if path == "/images/create" and method == "POST":
+            img = srv.images[IMAGE_NAME]
+            img["RepoDigests"] = ["alisw/alidock@" + srv.registryDigest]
+            if srv.registryDigest != LOCAL_DIGEST:
+                img["Id"] = "sha256:" + "f" * 64  # a new image
+            # Pull progress is streamed as a sequence of JSON objects
+            return 200, ({"status": "Pulling from alisw/alidock", "id": "latest"},
+                         {"status": "Already exists", "id": "0a"},
+                         {"status": "Pulling fs layer", "id": "0b"},
+                         {"status": "Downloading", "id": "0b",
+                          "progressDetail": {"current": 1 << 20, "total": 1 << 21}},
+                         {"status": "Download complete", "id": "0b"},
+                         {"status": "Pull complete", "id": "0b"},
+                         {"status": "Status: Downloaded newer image for " + IMAGE_NAME})
+        return notFound(path)
+
+    def routeContainers(self, method, path, query, body):
+        srv = self.server
+        if path == "/containers/json":
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            conts = list(srv.containers.values())
+            if query.get("all", ["0"])[0] in ["0", "false"]:
+                conts = [c for c in conts if c["State"]["Running"]]
+            for label in filters.get("label", []):
+                key, _, val = label.partition("=")
+                conts = [c for c in conts if key in c["Config"]["Labels"] and
+                         (not val or c["Config"]["Labels"][key] == val)]
+            for status in filters.get("status", []):
+                conts = [c for c in conts if c["State"]["Status"] == status]
+            return 200, [{"Id": c["Id"], "Names": [c["Name"]], "Image": c["Config"]["Image"],
+                          "Labels": c["Config"]["Labels"], "State": c["State"]["Status"]}
+                         for c in conts]
+        if path == "/commit" and method == "POST":
+            cont = srv.findContainer(query.get("container", [""])[0])
+            if not cont:
+                return notFound(path)
+            name = "{repo}:{tag}".format(repo=query["repo"][0], tag=query["tag"][0])
+            srv.images[name] = {"Id": "sha256:" + os.urandom(32).hex(), "RepoTags": [name],
+                                "RepoDigests": [], "Config": {"Cmd": cont["Config"]["Cmd"]}}
+            return 201, {"Id": srv.images[name]["Id"]}
+        if path == "/containers/create" and method == "POST":
+            name = query.get("name", [""])[0]
+            if srv.findContainer(name):
+                return 409, {"message": "Conflict"}
+            return 201, {"Id": srv.addContainer(name, body, running=False)["Id"], "Warnings": []}
+        return notFound(path)
+
+    def routeContainer(self, method, path, query):
+        srv = self.server
+        match = re.match(r"^/containers/([^/]+)(/[a-z]+)?$", path)
+        cont = srv.findContainer(match.group(1)) if match else None
+        if not cont:
+            return notFound(path)
+        action = match.group(2) or ""
+        code, payload = 204, None
+        if action == "/json":
+            code, payload = 200, {k: v for k, v in cont.items() if k != "banner"}
+        elif action == "/logs":
+            code = 200
+        elif action == "/stats":
+            code, payload = 200, {"memory_stats": {"usage": 1 << 20, "limit": 1 << 30},
+                                  "cpu_stats": {}, "precpu_stats": {}}
+        elif action == "/start":
+            srv.startContainer(cont)
+        elif action in ["/pause", "/unpause"]:
+            cont["State"]["Status"] = "paused" if action == "/pause" else "running"
+        elif action == "/rename":
+            cont["Name"] = "/" + query["name"][0]
+        elif action in ["/stop", "/kill", "/wait"]:
+            cont["State"].update({"Status": "exited", "Running": False})
+            srv.stopBanner(cont)
+            if action == "/wait":
+                code, payload = 200, {"StatusCode": 0}
+        elif action == "" and method == "DELETE":
+            srv.stopBanner(cont)
+            del srv.containers[cont["Id"]]
+        else:
+            return notFound(path)
+        return code, payload
+
+def notFound(path):
+    return 404, {"message": "No such object: " + path}
+
+def prepareHome(workDir):
+    """Create a home directory with fresh update checks, and fake ssh and docker in the PATH."""
+    sharedDir = os.path.join(workDir, "alidock")
+    os.makedirs(sharedDir)
+    for stateFile in [".alidock_pip_check", ".alidock_docker_check"]:
+        with open(os.path.join(sharedDir, stateFile), "w") as fil:
+            fil.write(str(int(time())))
+    binDir = os.path.join(workDir, "bin")
+    os.makedirs(binDir)
+    for fakeCmd in ["ssh", "docker"]:
+        with open(os.path.join(binDir, fakeCmd), "w") as fil:
+            fil.write("#!/bin/sh\nexit 0\n")
+        os.chmod(os.path.join(binDir, fakeCmd), stat.S_IRWXU)
+    return binDir
+
+def runAlidock(cliArgs, env):
+    """Run alidock in a new interpreter. Returns exit code, wall time (ms) and peak RSS (MB)."""
+    nul = open(os.devnull, "w")
+    start = time()
+    proc = subprocess.Popen([sys.executable, "-c", "from alidock import entrypoint; entrypoint()"] +
+                            cliArgs, stdout=nul, stderr=nul, env=env)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = (time() - start) * 1000.
+    proc.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    maxRss = rusage.ru_maxrss / (1024. * 1024. if sys.platform == "darwin" else 1024.)
+    return proc.returncode, elapsed, maxRss
+
+class Scenarios(object):
+    """Scenarios of the benchmark. Each setup method brings the fake daemon srv, and the home
+       directory workDir, in the state required by a scenario: it is called before each run."""
+
+    def __init__(self, srv, workDir, env):
+        self.srv = srv
+        self.workDir = workDir
+        self.env = env
+        self.runDir = os.path.join(workDir, "alidock", ".alidock-alidock")
+        self.dockName = "alidock-{uid}".format(uid=os.getuid())
+        self.control = []
+        self.digestCache = DigestCache(os.path.join(workDir, "alidock-registry-cache"))
+
+    def removeAll(self):
+        for cont in list(self.srv.containers.values()):
+            self.srv.stopBanner(cont)
+        self.srv.containers.clear()
+        self.srv.registryDigest = LOCAL_DIGEST
+        self.srv.images = {IMAGE_NAME: {"Id": IMAGE_ID, "RepoTags": [IMAGE_NAME],
+                                        "RepoDigests": ["alisw/alidock@" + LOCAL_DIGEST]}}
+        for fileName in ["endpoint.json", "ready", "active", "frozen.json", "kept", "bake.json",
+                         os.path.join("ssh", "control")]:
+            try:
+                os.unlink(os.path.join(self.runDir, fileName))
+            except OSError:
+                pass
+        while self.control:
+            self.control.pop().close()
+        shutil.rmtree(self.digestCache.cacheDir, ignore_errors=True)
+        with open(os.path.join(self.workDir, "alidock", ".alidock_docker_check"), "w") as fil:
+            fil.write(str(int(time())))
+
+    def running(self):
+        self.removeAll()
+        self.srv.addContainer(self.dockName, {"Image": IMAGE_NAME})
+
+    def runningWithMaster(self):
+        self.running()
+        try:
+            os.makedirs(os.path.join(self.runDir, "ssh"))
+        except OSError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member
+        sock.bind(os.path.join(self.runDir, "ssh", "control"))
+        sock.listen(16)
+        self.control.append(sock)
+        with open(os.path.join(self.runDir, "endpoint.json"), "w") as fil:
+            json.dump({"containerId": "0", "sshPort": "22", "xPort": None,
+                       "privKey": os.path.join(self.runDir, "ssh", "alidock.pem")}, fil)
+
+    def fleet(self):
+        self.removeAll()
+        for name in ["fleet1", "fleet2", "fleet3"]:
+            self.srv.addContainer("{name}-{uid}".format(name=name, uid=os.getuid()),
+                                  {"Image": IMAGE_NAME,
+                                   "Labels": {"alidock.name": name,
+                                              "alidock.userId": str(os.getuid())}})
+
+    def idle(self):
+        self.running()
+        with open(os.path.join(self.runDir, "active"), "w") as fil:
+            fil.write(str(int(time()) - 86400))
+
+    def frozen(self):
+        self.runningWithMaster()
+        self.srv.findContainer(self.dockName)["State"]["Status"] = "paused"
+        with open(os.path.join(self.runDir, "frozen.json"), "w") as fil:
+            json.dump({"pausedAt": int(time()), "memoryBytes": 1 << 20}, fil)
+
+    def kept(self):
+        self.removeAll()
+        for cliArgs in [["start"], ["stop", "--keep"]]:
+            if runAlidock(cliArgs, self.env)[0] != 0:
+                raise RuntimeError("cannot prepare a kept container")
+
+    def bake(self):
+        if runAlidock(["bake"], self.env)[0] != 0:
+            raise RuntimeError("cannot bake the image")
+
+    def baked(self):
+        self.removeAll()
+        self.bake()
+
+    def bakedRunning(self):
+        self.baked()
+        if runAlidock(["start"], self.env)[0] != 0:
+            raise RuntimeError("cannot start the baked image")
+
+    def imageUpdate(self):
+        self.removeAll()
+        os.unlink(os.path.join(self.workDir, "alidock", ".alidock_docker_check"))
+        self.srv.registryDigest = "sha256:" + "e" * 64
+        # As checked by another user a moment ago: the registry is not contacted
+        self.digestCache.store(IMAGE_NAME, self.srv.registryDigest)
+
+    def bakedImageUpdate(self):
+        self.imageUpdate()
+        self.bake()  # on top of the image being updated
+
+    def list(self):
+        """Return a list of (name, setup method, command line, budget of round-trips)."""
+        return [("start (new container)", self.removeAll, ["start"], 6),
+                ("start (image update)", self.imageUpdate, ["start"], 8),
+                ("prefetch (image update)", self.imageUpdate,
+                 ["--prefetch-max-load", "1000", "prefetch"], 4),
+                ("status (running)", self.running, ["status"], 2),
+                ("status --json (running)", self.running, ["status", "--json"], 2),
+                ("status --json --stats (running)", self.running,
+                 ["status", "--json", "--stats"], 3),
+                ("exec (running, no SSH master)", self.running, ["exec", "/bin/true"], 2),
+                ("exec (running, live SSH master)", self.runningWithMaster,
+                 ["exec", "/bin/true"], 0),
+                ("exec --transport docker (new)", self.removeAll,
+                 ["--transport", "docker", "exec", "/bin/true"], 7),
+                ("exec --transport docker (running)", self.running,
+                 ["--transport", "docker", "exec", "/bin/true"], 1),
+                ("freeze alidock (idle)", self.idle, ["freeze", "alidock"], 4),
+                ("exec (frozen, live SSH master)", self.frozen, ["exec", "/bin/true"], 3),
+                ("stop --keep (running)", self.running, ["stop", "--keep"], 3),
+                ("start (kept container)", self.kept, ["start"], 5),
+                ("stop (running)", self.running, ["stop"], 3),
+                ("bake", self.removeAll, ["bake"], 13),
+                ("start (baked image)", self.baked, ["start"], 8),
+                ("prefetch (running baked image)", self.bakedRunning,
+                 ["--prefetch-max-load", "1000", "prefetch"], 5),
+                ("start (image update, baked image)", self.bakedImageUpdate, ["start"], 22),
+                ("start 3 names (new containers)", self.removeAll,
+                 ["start", "fleet1", "fleet2", "fleet3"], 16),
+                ("status --all (3 running)", self.fleet, ["status", "--all"], 1),
+                ("stop --all (3 running)", self.fleet, ["stop", "--all"], 8)]
+
+def getEnv(workDir):
+    """Environment of the alidock runs: workDir is the home directory, where the socket of the fake
+       daemon is, and fake ssh and docker are in the PATH."""
+    env = os.environ.copy()
+    env["HOME"] = workDir
+    env["DOCKER_HOST"] = "unix://" + os.path.join(workDir, "docker.sock")
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env["PATH"] = prepareHome(workDir) + os.pathsep + env.get("PATH", "")
+    env["TMPDIR"] = workDir  # the registry digest cache is in there
+    return env
+
+def runScenario(srv, scenario, env, args):
+    """Run the given scenario args.runs times. Returns a tuple with the status of the scenario and
+       the formatted measurements."""
+    name, setup, cliArgs, budget = scenario
+    results = []
+    for _ in range(args.runs):
+        setup()
+        srv.reset()
+        ret, elapsed, maxRss = runAlidock(cliArgs, env)
+        results.append((ret, elapsed, maxRss, len(srv.requests)))
+    if args.verbose:
+        print("\n".join("  " + req for req in srv.requests))
+    trips = max(res[3] for res in results)
+    status = "OK"
+    if trips > budget or any(res[0] != 0 for res in results):
+        status = "FAIL" + (" (exit code {ret})".format(ret=results[-1][0])
+                           if results[-1][0] else "")
+    return {"name": name, "trips": trips, "budget": budget, "status": status,
+            "ms": "{:.1f}".format(sorted(res[1] for res in results)[len(results)//2]),
+            "mem": "{:.1f}".format(max(res[2] for res in results))}
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+    argp.add_argument("--latency-ms", dest="latency", type=float, default=5.,
+                      help="Latency of each Docker API request (default: %(default)s ms)")
+    argp.add_argument("--runs", type=int, default=3,
+                      help="Number of runs per scenario (default: %(default)s)")
+    argp.add_argument("--verbose", default=False, action="store_true",
+                      help="Print the Docker API requests of each scenario")
+    args = argp.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="alidock-bench-")
+    srv = FakeDocker(os.path.join(workDir, "docker.sock"), args.latency / 1000.)
+    thr = threading.Thread(target=srv.serve_forever)
+    thr.daemon = True
+    thr.start()
+    env = getEnv(workDir)
+
+    failed = False
+    fmt = "{name:<34} {trips:>6} {budget:>6} {ms:>10} {mem:>8}  {status}"
+    print(fmt.format(name="scenario", trips="trips", budget="budget", ms="time (ms)",
+                     mem="RSS (MB)", status=""))
+    try:
+        for scenario in Scenarios(srv, workDir, env).list():
+            result = runScenario(srv, scenario, env, args)
+            failed = failed or result["status"] != "OK"
+            print(fmt.format(**result))
+    finally:
+        srv.shutdown()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
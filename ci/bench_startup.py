@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""Cold startup benchmark for the alidock command line.
+
+Runs `alidock --version`, `alidock exec` and `alidock status --json` several
+times in fresh interpreters, and reports their wall time net of the bare Python
+interpreter startup. It fails if any of the heavy modules that must be loaded
+lazily ends up being imported on those code paths, or if `status --json`, meant
+to be polled by scripts, is not fast enough: its budget is scaled with the
+interpreter startup, as wall times depend on the host. Other budgets can be
+given with the --max-*-ms options. No Docker daemon is needed: `exec` and `status` are pointed to a
+nonexistent Docker socket, and they are measured until their first attempt to
+contact the daemon. The hot `exec` path, where a live SSH master connection to
+the container exists, is also measured: it must not contact Docker at all.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import os.path
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from time import time
+from bench_docker import prepareHome
+
+# Default budget of `alidock status --json`: 100 ms over the interpreter startup, or twice the
+# interpreter startup on hosts where the interpreter alone takes more than 50 ms
+STATUS_BUDGET_MS = 100
+STATUS_BUDGET_STARTUPS = 2
+
+# Modules that must not be loaded by each benchmarked command
+FORBIDDEN = {
+    "version": ["docker", "requests", "jinja2", "yaml", "colorama", "http.client"],
+    "exec": ["jinja2", "yaml", "pkg_resources"],
+    "status": ["docker", "requests", "jinja2", "yaml", "pkg_resources"],
+    "hot": []  # modules cannot be listed: ssh replaces the process
+}
+
+CHILD = """
+import atexit, json, os, sys
+def dumpModules():
+    with open(os.environ["ALIDOCK_BENCH_MODULES"], "w") as fil:
+        json.dump(sorted(sys.modules), fil)
+atexit.register(dumpModules)
+sys.argv = ["alidock"] + sys.argv[1:]
+from alidock import entrypoint
+entrypoint()
+"""
+
+def timeRun(cmd, env):
+    nul = open(os.devnull, "w")
+    start = time()
+    ret = subprocess.call(cmd, stdout=nul, stderr=nul, env=env)
+    return (time() - start) * 1000., ret
+
+def median(vals):
+    vals = sorted(vals)
+    mid = len(vals) // 2
+    return vals[mid] if len(vals) % 2 else (vals[mid-1] + vals[mid]) / 2.
+
+def prepareEnv(workDir):
+    """Prepare a fake home directory where update checks have just been performed, in order to
+       benchmark the hot path, with fake ssh and docker executables (see
+       bench_docker.prepareHome)."""
+    env = os.environ.copy()
+    env["HOME"] = workDir
+    env["DOCKER_HOST"] = "unix://" + os.path.join(workDir, "nonexistent.sock")
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env["ALIDOCK_BENCH_MODULES"] = os.path.join(workDir, "modules.json")
+    prepareHome(workDir)
+    return env
+
+def prepareHotPath(workDir, env):
+    """Fake a running container with a live SSH master connection. The fake ssh executable made by
+       prepareEnv is put in the PATH. Returns the environment and the listening control
+       socket."""
+    runDir = os.path.join(workDir, "alidock", ".alidock-alidock")
+    os.makedirs(os.path.join(runDir, "ssh"))
+    privKey = os.path.join(runDir, "ssh", "alidock.pem")
+    open(privKey, "w").close()
+    with open(os.path.join(runDir, "endpoint.json"), "w") as fil:
+        json.dump({"containerId": "0", "sshPort": "22", "xPort": None, "privKey": privKey}, fil)
+    control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member
+    control.bind(os.path.join(runDir, "ssh", "control"))
+    control.listen(128)
+
+    hotEnv = env.copy()
+    hotEnv["PATH"] = os.path.join(workDir, "bin") + os.pathsep + env.get("PATH", "")
+    return hotEnv, control
+
+def benchCommand(name, cliArgs, budget, bench):
+    """Time the alidock command with the given arguments, check which modules it loaded (or, for
+       the hot path, that it did not contact Docker) and report. The bench dictionary holds the
+       work directory, the environment, the number of runs and the interpreter startup time.
+       Returns whether the command passed."""
+    runEnv = bench["env"]
+    if name == "hot":
+        runEnv, control = prepareHotPath(bench["workDir"], bench["env"])
+    cmd = [sys.executable, "-c", CHILD] + cliArgs
+    results = [timeRun(cmd, runEnv) for _ in range(bench["runs"])]
+    overhead = median([res[0] for res in results]) - bench["baseline"]
+    problems = []
+    if name == "hot":
+        control.close()
+        if any(res[1] != 0 for res in results):
+            problems = ["command failed (was Docker contacted?)"]
+    else:
+        with open(bench["env"]["ALIDOCK_BENCH_MODULES"]) as fil:
+            loaded = set(json.load(fil))
+        problems = ["unexpected module " + mod for mod in FORBIDDEN[name] if mod in loaded]
+    if budget is not None and overhead > budget:
+        problems.append("over budget ({budget:.0f} ms)".format(budget=budget))
+    print("alidock {args}{hot}: {ms:.1f} ms over interpreter startup{bad} [{status}]".format(
+        args=" ".join(cliArgs), ms=overhead, hot=" (hot)" if name == "hot" else "",
+        bad="".join(", " + prob for prob in problems), status="FAIL" if problems else "OK"))
+    return not problems
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+    argp.add_argument("--runs", type=int, default=10,
+                      help="Number of runs per command (default: %(default)s)")
+    statusDefault = "{ms} ms, or {num} interpreter startups if more".format(
+        ms=STATUS_BUDGET_MS, num=STATUS_BUDGET_STARTUPS)
+    for opt, dest, what, default in [
+            ("--max-version-ms", "maxVersion", "`alidock --version`", "no budget"),
+            ("--max-exec-ms", "maxExec", "`alidock exec`", "no budget"),
+            ("--max-status-ms", "maxStatus", "`alidock status --json`", statusDefault),
+            ("--max-hot-exec-ms", "maxHotExec", "`alidock exec` with a live SSH connection",
+             "no budget")]:
+        argp.add_argument(opt, dest=dest, type=float, default=None,
+                          help="Fail if the overhead of {what} exceeds this (default: "
+                               "{default})".format(what=what, default=default))
+    args = argp.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="alidock-bench-")
+    failed = False
+    try:
+        env = prepareEnv(workDir)
+        baseline = median([timeRun([sys.executable, "-c", "pass"], env)[0]
+                           for _ in range(args.runs)])
+        print("Python interpreter startup: {ms:.1f} ms".format(ms=baseline))
+        bench = {"workDir": workDir, "env": env, "runs": args.runs, "baseline": baseline}
+        if args.maxStatus is None:
+            args.maxStatus = max(STATUS_BUDGET_MS, STATUS_BUDGET_STARTUPS * baseline)
+
+        for name, cliArgs, budget in [("version", ["--version"], args.maxVersion),
+                                      ("exec", ["exec", "/bin/true"], args.maxExec),
+                                      ("status", ["status", "--json"], args.maxStatus),
+                                      ("hot", ["exec", "/bin/true"], args.maxHotExec)]:
+            if not benchCommand(name, cliArgs, budget, bench):
+                failed = True
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
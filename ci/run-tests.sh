@@ -46,6 +46,18 @@ fold_start "Running pylint"
                       -a -not -path './build/*' | xargs pylint
 fold_end
 
+fold_start "Unit tests"
+  python -m unittest discover -s ci -p 'test_*.py'
+fold_end
+
+fold_start "Startup benchmark"
+  python ci/bench_startup.py
+fold_end
+
+fold_start "Docker API benchmark"
+  python ci/bench_docker.py
+fold_end
+
 fold_start "Producing wheel"
   if [[ $TRAVIS_TAG && $TRAVIS_PULL_REQUEST == false ]]; then
     # Real deployment: use official index server
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Tests of Freezer.freezeIfIdle with a mocked Docker client: the container is marked as frozen
+before it is paused, so that the hot path of `exec` never uses a paused container."""
+
+import os
+import os.path
+import unittest
+from time import time
+from unittest import mock
+
+from testcase import AliDockTestCase
+import docker
+from alidock import AliDockError
+from alidock.freeze import Freezer
+
+class FreezeTest(AliDockTestCase):
+
+    def setUp(self):
+        super(FreezeTest, self).setUp()
+        self.container = mock.MagicMock()
+        self.container.attrs = {"Id": "0123abcd", "State": {"Status": "running"}}
+        self.startPatches([mock.patch.object(Freezer, "getMemoryUsage", return_value=1 << 20)])
+        self.aliDock = self.newAliDock()
+        self.aliDock.cli.containers.get.return_value = self.container
+        self.freezer = Freezer(self.aliDock)
+        self.frozenPath = os.path.join(self.aliDock.getRunDir(), "frozen.json")
+        os.makedirs(self.aliDock.getRunDir())
+        with open(os.path.join(self.aliDock.getRunDir(), "active"), "w") as fil:
+            fil.write(str(int(time()) - 3600))
+
+    def testMarkedBeforePause(self):
+        self.container.pause.side_effect = lambda: self.assertTrue(os.path.isfile(self.frozenPath))
+        self.assertEqual(self.freezer.freezeIfIdle(60)["state"], "frozen")
+        self.container.pause.assert_called_once_with()
+        self.assertEqual(self.freezer.getFrozenInfo()["memoryBytes"], 1 << 20)
+
+    def testPauseFailed(self):
+        self.container.pause.side_effect = docker.errors.APIError("cannot pause")
+        with self.assertRaises(AliDockError):
+            self.freezer.freezeIfIdle(60)
+        self.assertFalse(os.path.exists(self.frozenPath))
+
+    def testActive(self):
+        self.assertEqual(self.freezer.freezeIfIdle(7200)["state"], "active")
+        self.container.pause.assert_not_called()
+        self.assertFalse(os.path.exists(self.frozenPath))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Tests of alidock.keep.restartKept with a mocked Docker client: only containers stopped by
+`alidock stop --keep` are restarted."""
+
+import os
+import unittest
+from unittest import mock
+
+from testcase import AliDockTestCase
+from alidock import AliDock
+from alidock.keep import getKeptId, restartKept
+
+class RestartKeptTest(AliDockTestCase):
+
+    def setUp(self):
+        super(RestartKeptTest, self).setUp()
+        self.container = mock.MagicMock()
+        self.container.attrs = {"Id": "0123abcd", "Image": "sha256:image",
+                                "State": {"Status": "exited"},
+                                "Config": {"Labels": {"alidock.fingerprint": "fingerprint"}},
+                                "NetworkSettings": {"Ports": {}}}
+        self.startPatches([
+            mock.patch.object(AliDock, "getFingerprint", return_value="fingerprint"),
+            mock.patch.object(AliDock, "getLocalImageId", return_value="sha256:image")])
+        self.aliDock = self.newAliDock()
+        self.aliDock.cli.containers.get.return_value = self.container
+        os.makedirs(self.aliDock.getRunDir())
+
+    def testKept(self):
+        self.aliDock.stop(keep=True)
+        self.container.stop.assert_called_once_with()
+        self.assertTrue(restartKept(self.aliDock))
+        self.container.start.assert_called_once_with()
+        self.assertIsNone(getKeptId(self.aliDock))
+
+    def testExitedByItself(self):
+        # e.g. its init script failed: it is not restarted, but removed
+        self.assertFalse(restartKept(self.aliDock))
+        self.container.start.assert_not_called()
+        self.container.remove.assert_called_once_with(force=True)
+
+    def testOtherContainerKept(self):
+        self.aliDock.stop(keep=True)
+        self.container.attrs["Id"] = "4567cdef"  # the kept container was replaced
+        self.aliDock.invalidateContainerState()
+        self.assertFalse(restartKept(self.aliDock))
+        self.container.start.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Tests of the registry digest cache shared by the users of the host (alidock.registry), with
+mocked registry requests."""
+
+import json
+import os
+import os.path
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from time import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# pylint: disable=wrong-import-position
+from alidock.registry import DigestCache, RegistryError, parseReference
+
+IMAGE_NAME = "alisw/alidock:latest"
+DIGEST = "sha256:" + "a" * 64
+
+class DigestCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix="alidock-test-")
+        self.cache = DigestCache(os.path.join(self.workDir, "cache"))
+        self.key = self.cache.entryKey(*parseReference(IMAGE_NAME))
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def writeEntry(self, owner, entry):
+        """Write an entry as if it was written by the user with the given ID."""
+        self.assertTrue(self.cache.isUsable())
+        with open(os.path.join(self.cache.cacheDir,
+                               "{key}-{owner}.json".format(key=self.key, owner=owner)), "w") as fil:
+            json.dump(entry, fil)
+
+    def testStickyDirectory(self):
+        self.cache.store(IMAGE_NAME, DIGEST)
+        mode = os.stat(self.cache.cacheDir).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o1777)
+        for name in os.listdir(self.cache.cacheDir):
+            mode = os.stat(os.path.join(self.cache.cacheDir, name)).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0o644)
+
+    def testFreshestEntry(self):
+        self.writeEntry("1", {"digest": "sha256:old", "etag": None, "checked": int(time()) - 60})
+        self.writeEntry("2", {"digest": DIGEST, "etag": None, "checked": int(time())})
+        with mock.patch.object(DigestCache, "headManifest") as headManifest:
+            self.assertEqual(self.cache.getDigest(IMAGE_NAME), DIGEST)
+        headManifest.assert_not_called()
+
+    def testInvalidEntries(self):
+        self.writeEntry("1", ["not", "a", "dict"])
+        self.writeEntry("2", {"digest": ["sha256:bad"], "etag": None, "checked": int(time())})
+        self.writeEntry("3", {"digest": "sha256:bad", "etag": 1, "checked": int(time())})
+        self.writeEntry("4", {"digest": "sha256:bad", "etag": None, "checked": "now"})
+        with mock.patch.object(DigestCache, "headManifest", return_value=(DIGEST, None)) as head:
+            self.assertEqual(self.cache.getDigest(IMAGE_NAME), DIGEST)
+        head.assert_called_once_with("registry-1.docker.io", "alisw/alidock", "latest", None)
+
+    def testTokenNotDict(self):
+        resp = mock.Mock(status_code=200)
+        resp.json.return_value = ["token"]
+        with mock.patch("requests.get", return_value=resp):
+            with self.assertRaises(RegistryError):
+                self.cache.getToken({"realm": "https://auth.example.com/token"}, "alisw/alidock")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Tests of AliDock.run with a mocked Docker client: containers of the warm pool and the alidock
+container, with and without mounts synced back to the host."""
+
+import os
+import os.path
+import posixpath
+import unittest
+from unittest import mock
+
+from testcase import AliDockTestCase
+from alidock import AliDock
+from alidock.bake import Baker
+from alidock.initscript import getInitParams
+
+ENDPOINT_FILES = ["endpoint.json", "ready", "ready-env", "frozen.json"]
+
+class RunTest(AliDockTestCase):
+
+    def setUp(self):
+        super(RunTest, self).setUp()
+        self.syncDir = os.path.join(self.workDir, "data")
+        os.makedirs(self.syncDir)
+        self.startPatches([mock.patch("alidock.ensureSshKeys"),
+                           mock.patch.object(AliDock, "getFingerprint", return_value="fingerprint"),
+                           mock.patch.object(Baker, "getBakedImage", return_value=None)])
+
+    def runContainer(self, poolId, syncMounts):
+        """Run a container with the given parameters, with a leftover endpoint of the alidock
+           container in its run directory. Returns the AliDock object, the labels the container
+           was started with, and which endpoint files are left."""
+        mounts = [self.syncDir + ":data:rw:volume=30"] if syncMounts else []
+        aliDock = self.newAliDock({"mount": mounts})
+        runDir = aliDock.getRunDir()
+        os.makedirs(runDir)
+        for fileName in ENDPOINT_FILES:
+            with open(os.path.join(runDir, fileName), "w") as fil:
+                fil.write("{}")
+        container = mock.MagicMock()
+        container.attrs = {"Id": "0", "NetworkSettings": {"Ports": {}}}
+        aliDock.cli.containers.run.return_value = container
+        aliDock.run(poolId=poolId)
+        labels = aliDock.cli.containers.run.call_args[1]["labels"]
+        left = [name for name in ENDPOINT_FILES if os.path.exists(os.path.join(runDir, name))]
+        return aliDock, labels, left
+
+    def testMain(self):
+        aliDock, labels, left = self.runContainer(None, syncMounts=False)
+        self.assertTrue(aliDock.endpoint.expectReady)
+        self.assertEqual(left, [])
+        self.assertNotIn("alidock.syncMounts", labels)
+        self.assertNotIn("alidock.pool", labels)
+
+    def testMainSyncMounts(self):
+        aliDock, labels, left = self.runContainer(None, syncMounts=True)
+        self.assertTrue(aliDock.endpoint.expectReady)
+        self.assertEqual(left, [])
+        self.assertIn("alidock.syncMounts", labels)
+
+    def testPool(self):
+        aliDock, labels, left = self.runContainer("abcd1234", syncMounts=False)
+        self.assertFalse(aliDock.endpoint.expectReady)
+        self.assertEqual(left, ENDPOINT_FILES)
+        self.assertNotIn("alidock.syncMounts", labels)
+        self.assertEqual(labels["alidock.runDir"], "pool/abcd1234")
+
+    def testPoolActiveFile(self):
+        # Pool containers must not record their activity as the one of the alidock container
+        aliDock = self.newAliDock()
+        runDirInside = posixpath.join(aliDock.getRunDirInside(), "pool", "abcd1234")
+        self.assertEqual(getInitParams(aliDock, runDirInside)["activeFile"],
+                         posixpath.join(runDirInside, "active"))
+
+    def testPoolSyncMounts(self):
+        aliDock, labels, left = self.runContainer("abcd1234", syncMounts=True)
+        self.assertFalse(aliDock.endpoint.expectReady)
+        self.assertEqual(left, ENDPOINT_FILES)
+        self.assertTrue(labels["alidock.syncMounts"].endswith("/pool/abcd1234/sync-mounts.sh"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Tests of the periodic update checks (UpdateChecker.hasUpdates) and of the handling of their
+results when they run in the background, or in a detached process when they take too long."""
+
+import threading
+import unittest
+from unittest import mock
+
+from testcase import AliDockTestCase
+from alidock import AliDock
+from alidock.updates import UpdateChecker, processClientUpdates, processImageUpdates
+from alidock.util import BackgroundCall
+
+class UpdatesTest(AliDockTestCase):
+
+    def setUp(self):
+        super(UpdatesTest, self).setUp()
+        self.aliDock = self.newAliDock({"updatePeriod": 3600})
+        self.checker = UpdateChecker(self.aliDock)
+
+    def hasUpdates(self, updateFunc):
+        return self.checker.hasUpdates(".check", 3600, "tag", updateFunc)
+
+    def testInterruptedCheck(self):
+        # A check still running when the process goes away is not attempted again by the next run:
+        # it is handed over to a detached process, whose forced check records the update found
+        started = threading.Event()
+        clientCheck = BackgroundCall(self.hasUpdates,
+                                     lambda: started.set() or threading.Event().wait())
+        started.wait(5)
+        with mock.patch("alidock.updates.UPDATE_CHECK_GRACE", 0), \
+             mock.patch("alidock.updates.spawnDetached") as spawnDetached:
+            processClientUpdates(self.aliDock, clientCheck)
+        spawnDetached.assert_called_once_with("checkClientUpdatesDetached",
+                                              self.aliDock.exportConf())
+        self.assertFalse(self.hasUpdates(lambda: self.fail("checked again")))
+        self.assertTrue(self.checker.hasUpdates(".check", 3600, "tag", lambda: True, force=True))
+        self.assertTrue(self.hasUpdates(lambda: self.fail("checked again")))
+
+    def testPendingUpdate(self):
+        self.assertTrue(self.hasUpdates(lambda: True))
+        self.assertTrue(self.hasUpdates(lambda: self.fail("checked again")))
+        self.assertEqual(self.checker.getState(".check")[1], "tag")
+
+    def testFailedCheck(self):
+        with self.assertRaises(RuntimeError):
+            self.hasUpdates(mock.Mock(side_effect=RuntimeError("no network")))
+        self.assertFalse(self.checker.isDue(".check", 3600))
+
+    def testForeignErrorsCaught(self):
+        # Errors other than AliDockError raised by a background check do not escape
+        imageCheck = BackgroundCall(mock.Mock(side_effect=OSError("connection refused")))
+        with mock.patch.object(AliDock, "pull") as pull:
+            processImageUpdates(self.aliDock, imageCheck)
+        pull.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+"""Base of the alidock tests: see AliDockTestCase."""
+
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# pylint: disable=wrong-import-position
+from alidock import AliDock
+
+class AliDockTestCase(unittest.TestCase):
+    """Test case running in a temporary home directory, workDir, with the Docker client of the
+       AliDock objects mocked."""
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix="alidock-test-")
+        self.addCleanup(shutil.rmtree, self.workDir, ignore_errors=True)
+        self.startPatches([mock.patch.dict(os.environ, {"HOME": self.workDir}),
+                           mock.patch.object(AliDock, "cli", new_callable=mock.PropertyMock)])
+
+    def startPatches(self, patches):
+        """Start the given patches, which are stopped at the end of the test."""
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def newAliDock(self, conf=None):
+        """Return an AliDock object with the given configuration, sharing the alidock directory of
+           the temporary home."""
+        return AliDock(dict(conf or {}, dirOutside=os.path.join(self.workDir, "alidock")))